@@ -6,19 +6,42 @@ from pydantic import ValidationError
 from sqlmodel import Session, create_engine, select
 
 from core.config import settings
-from db.connector import DBClient
+from db.blob import create_blob_store
+from db.connector import AsyncDBClient
+from db.replica import as_user
 from utils import log
 
 log = log.Logger(__name__, clevel=log.logging.DEBUG)
 
 
-def get_db() -> DBClient:
+def get_db() -> AsyncDBClient:
     connector = None
     try:
-        connector = DBClient(str(settings.SQLALCHEMY_DATABASE_URI))
+        if settings.DB_BACKEND == "sqlite":
+            connector = AsyncDBClient.sqlite(settings.SQLITE_PATH)
+        else:
+            connector = AsyncDBClient(
+                str(settings.SQLALCHEMY_ASYNC_DATABASE_URI),
+                replica_urls=settings.REPLICA_DATABASE_URIS,
+            )
+        connector.metrics.slow_ms = settings.DB_SLOW_QUERY_MS
+        connector.archive = create_blob_store(
+            settings.ARCHIVE_URL,
+            endpoint=settings.oss_endpoint,
+            access_key=settings.oss_access_key,
+            access_key_secret=settings.oss_access_key_secret,
+        )
     except Exception as err:
         log.debug(f"connect db error with :{err}")
 
     return connector
 
 db_client = get_db()
+
+
+async def db_user(user_id: int) -> None:
+    '''
+    dependency of /user/{user_id}/... routes: after a write of the user, their
+    reads stay on the primary for the replica lag, in later requests too
+    '''
+    as_user(user_id)
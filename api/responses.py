@@ -0,0 +1,30 @@
+import json
+
+from fastapi.responses import JSONResponse as BaseJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dump(content):
+    '''
+    serialize to compact utf-8 json, with orjson when it is installed
+    '''
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class JSONResponse(BaseJSONResponse):
+    '''
+    JSONResponse rendering with dump, bytes content is taken as already
+    serialized json and sent as is
+    '''
+
+    def render(self, content) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dump(content)
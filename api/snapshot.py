@@ -0,0 +1,83 @@
+import asyncio
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+from api.responses import dump
+
+
+class Snapshot:
+    '''
+    in memory copy of a catalog keyed by its version (the Shares update time),
+    the catalog is only reloaded when the version changes
+    loader: async callable returning the catalog
+    '''
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.version = None
+        self.data = None
+        self.bodies = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, version):
+        if self.data is None or version != self.version:
+            async with self._lock:
+                if self.data is None or version != self.version:
+                    data = await self.loader()
+                    self.data, self.version, self.bodies = data, version, {}
+        return self.data
+
+    def body(self, version, key, render):
+        '''
+        serialized response rendered from the catalog, kept per key until
+        the version changes
+        '''
+        if version != self.version:
+            return render()
+        body = self.bodies.get(key)
+        if body is None:
+            body = self.bodies[key] = render()
+        return body
+
+    def invalidate(self):
+        self.data = None
+
+
+def etag(name, version, *parts):
+    return '"' + "-".join(str(x) for x in (name, version) + parts) + '"'
+
+
+def not_modified(request: Request, tag, version):
+    '''
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    '''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or tag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and version is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return version <= since
+    return False
+
+
+def cached_response(request: Request, tag, version, body):
+    '''
+    body: serialized json, or a callable producing it, only called if the
+        client copy is stale
+    '''
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if version is not None:
+        headers["Last-Modified"] = formatdate(version, usegmt=True)
+    if not_modified(request, tag, version):
+        return Response(status_code=304, headers=headers)
+    if callable(body):
+        body = body()
+    return Response(content=body, status_code=200, headers=headers,
+                    media_type="application/json")
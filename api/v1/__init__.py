@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from . import text, user, chatdb, bot, assistant, tools, mcp
+from . import text, user, chatdb, bot, assistant, tools, mcp, usage, backup
 
 
 api_router = APIRouter()
@@ -11,3 +11,5 @@ api_router.include_router(bot.router, tags=["Bot"])
 api_router.include_router(assistant.router, tags=["Assistant"])
 api_router.include_router(tools.router, tags=["Tools"])
 api_router.include_router(mcp.router, tags=["MCP"])
+api_router.include_router(usage.router, tags=["Usage"])
+api_router.include_router(backup.router, tags=["Backup"])
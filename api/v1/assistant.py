@@ -2,7 +2,7 @@ import time
 from typing import Any, List, Dict, Optional, Annotated
 from fastapi import APIRouter, Path, Body, Depends
 from fastapi import File, UploadFile
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse
 from sse_starlette.sse import EventSourceResponse
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
@@ -12,6 +12,7 @@ import time
 
 from utils import assistant, log
 from api.deps import db_client
+from api.responses import JSONResponse
 
 router = APIRouter()
 log = log.Logger(__name__, clevel=log.logging.DEBUG)
@@ -0,0 +1,108 @@
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+
+from utils import log
+from api.deps import db_client
+from api.responses import JSONResponse, dump
+from core.security import verify_admin
+from db.importer import BATCH, Importer, iter_lines
+
+router = APIRouter(dependencies=[Depends(verify_admin)])
+log = log.Logger(__name__, clevel=log.logging.DEBUG)
+
+EXPORT_TABLES = ["users", "chats", "messages", "bots", "orders"]
+
+
+def export_rows(table, since, after_id, batch, user_id, author_id, status, public):
+    if table == "users":
+        return db_client.user.export(
+            since=since, after_id=after_id, batch=batch)
+    if table == "chats":
+        tbl = db_client.chat.tbl
+        where = [tbl.user_id == user_id] if user_id is not None else []
+        return db_client.chat.export(
+            *where, since=since, after_id=after_id, batch=batch)
+    if table == "messages":
+        return db_client.chat.export_messages(
+            user_id=user_id, since=since, after_id=after_id, batch=batch)
+    if table == "bots":
+        tbl = db_client.bot.tbl
+        where = []
+        if author_id is not None:
+            where.append(tbl.author_id == author_id)
+        if public is not None:
+            where.append(tbl.public == public)
+        return db_client.bot.export(
+            *where, since=since, after_id=after_id, batch=batch)
+    if table == "orders":
+        tbl = db_client.order.tbl
+        where = []
+        if user_id is not None:
+            where.append(tbl.user_id == user_id)
+        if status is not None:
+            where.append(tbl.status == status)
+        return db_client.order.export(
+            *where, since=since, after_id=after_id, batch=batch)
+    return None
+
+
+async def ndjson(batches, table):
+    last_id = None
+    try:
+        async for rows in batches:
+            yield b"".join(dump(dict(row)) + b"\n" for row in rows)
+            last_id = rows[-1]["id"]
+    except Exception as err:
+        # the status line is already sent, the client resumes with after_id
+        log.error(f"export {table} stopped after id {last_id}: {err}")
+
+
+@router.get("/export/{table}", name="export table")
+async def export_table(
+        table: str,
+        since: Optional[int] = None,
+        after_id: Optional[int] = None,
+        batch: int = Query(1000, ge=1, le=10000),
+        user_id: Optional[int] = None,
+        author_id: Optional[int] = None,
+        status: Optional[int] = None,
+        public: Optional[bool] = None,
+    ) -> Any:
+    """
+    stream one table as NDJSON, one row per line ordered by id.
+    table: users, chats, messages, bots or orders
+    since: rows updated at or after this timestamp
+    after_id: resume an interrupted export after the last id received
+    """
+    batches = export_rows(table, since, after_id, batch,
+                          user_id, author_id, status, public)
+    if batches is None:
+        return JSONResponse(
+            status_code=404,
+            content={"result": f"unknown table, one of {EXPORT_TABLES}"})
+    return StreamingResponse(ndjson(batches, table), media_type="application/x-ndjson")
+
+
+@router.post("/import/{table}", name="import table")
+async def import_table(
+        table: str,
+        request: Request,
+        batch: int = Query(BATCH, ge=1, le=50000),
+        skip_existing: bool = True,
+    ) -> Any:
+    """
+    bulk load NDJSON in the export format from the request body, each batch
+    is one transaction. import users before chats and chats before messages.
+    return: the import report with the lines of the failed batches
+    """
+    try:
+        importer = Importer(db_client, table, batch, skip_existing)
+    except ValueError as err:
+        return JSONResponse(status_code=404, content={"result": str(err)})
+    try:
+        report = await importer.run_async(iter_lines(request.stream()))
+    except Exception as err:
+        log.error(f"import {table} error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err), "report": importer.report})
+    return JSONResponse(status_code=200, content={"result": "success", "report": report})
@@ -1,14 +1,18 @@
 import time
 from typing import Any, List, Dict, Optional, Annotated
-from fastapi import APIRouter, Path, Body, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Path, Body, Depends, Request
 from pydantic import BaseModel
 
 from utils import assistant, log
 from api.deps import db_client
+from api.responses import JSONResponse, dump
+from api.snapshot import Snapshot, cached_response, etag
 
 router = APIRouter()
 log = log.Logger(__name__, clevel=log.logging.DEBUG)
+bots_snapshot = Snapshot("bots", lambda: db_client.bot.get_all_bots())
+if db_client:
+    db_client.notify.subscribe("bot", lambda payload: bots_snapshot.invalidate())
 
 
 class BotData(BaseModel):
@@ -85,36 +89,36 @@ async def bot_new(bot: BotData) -> Any:
         bot_data["created_at"] = updated_at
         bot_data["updated_at"] = updated_at
         bot_data["assistant_id"] = assistant_id
-        newbot = db_client.bot.add_new_bot(
+        newbot = await db_client.bot.add_new_bot(
             **bot_data
         )
-        update_shares(updated_at)
+        await update_shares(updated_at)
     except Exception as err:
         log.debug(f"add bot error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
     return JSONResponse(status_code=200, content=newbot)
 
 
-@router.post("/bot/bots", name="get all bot")
-async def bot_all() -> Any:
-    bots = None
-    shares = None
+@router.api_route("/bot/bots", methods=["GET", "POST"], name="get all bot")
+async def bot_all(request: Request) -> Any:
     try:
-        bots = db_client.bot.get_all_bots()
-        shares = db_client.shares.get_all_shares()
+        shares = await db_client.shares.get_all_shares()
+        version = shares.get("bot_updated")
+        bots = await bots_snapshot.get(version)
     except Exception as err:
         log.debug(f"get bots error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
-    return JSONResponse(
-        status_code=200,
-        content={"bots": bots, "date": shares.get("bot_updated")})
+    return cached_response(
+        request, etag("bots", version), version,
+        lambda: bots_snapshot.body(
+            version, None, lambda: dump({"bots": bots, "date": version})))
 
 
 @router.post("/bot/{bot_id}/info", name="get bot info")
 async def bot_info(bot_id: int) -> Any:
     bot = None
     try:
-        bot = db_client.bot.get_bot_by_id(bot_id)
+        bot = await db_client.bot.get_bot_by_id(bot_id)
     except Exception as err:
         return JSONResponse(status_code=500, content={"result": str(err)})
     if bot is None:
@@ -143,11 +147,11 @@ async def bot_edit(bot_id: int, bot: BotData) -> Any:
                 new_data["assistant_id"] = new_assistant.id
 
         new_data["updated_at"] = int(time.time())
-        new_data = db_client.bot.update_bot_by_id(
+        new_data = await db_client.bot.update_bot_by_id(
             bot_id,
             **new_data,
         )
-        update_shares(new_data["updated_at"])
+        await update_shares(new_data["updated_at"])
     except Exception as err:
         log.debug(f"edit bot error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -161,10 +165,10 @@ async def bot_delete(bot_id: int, assistant_id: str) -> Any:
         if assistant_id:
             del_asst = await assistant.delete_assistant(assistant_id)
             if del_asst and del_asst.deleted == True:
-                db_client.bot.delete_bot(bot_id=bot_id)
+                await db_client.bot.delete_bot(bot_id=bot_id)
         else:
-            db_client.bot.delete_bot(bot_id=bot_id)
-        update_shares(int(time.time()))
+            await db_client.bot.delete_bot(bot_id=bot_id)
+        await update_shares(int(time.time()))
     except Exception as err:
         log.debug(f"delete bot error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -175,19 +179,15 @@ async def bot_delete(bot_id: int, assistant_id: str) -> Any:
 async def get_shares() -> Any:
     shared = None
     try:
-        shared = db_client.shares.get_all_shares()
+        shared = await db_client.shares.get_all_shares()
     except Exception as err:
         log.debug(f"update_shared error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
     return JSONResponse(status_code=200, content=shared)
 
 
-def update_shares(updated_at):
+async def update_shares(updated_at):
     try:
-        shared = db_client.shares.get_all_shares()
-        if shared:
-            db_client.shares.update_shares_by_id(
-                shared["id"],
-                bot_updated=updated_at)
+        await db_client.shares.touch("bot_updated", updated_at)
     except Exception as err:
         log.debug(f"update_shared error:{err}")
@@ -1,16 +1,20 @@
 import time
-from typing import Any, List, Dict, Optional
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from typing import Any, List, Dict, Literal, Optional
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel, Field
 
 from utils import log
 from utils import chat as chatlib
 from utils import credit
-from api.deps import db_client
+from utils.chatbuffer import ChatWriteBuffer
+from api.deps import db_client, db_user
+from api.responses import JSONResponse
+from core.config import settings
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(db_user)])
 log = log.Logger(__name__, clevel=log.logging.DEBUG)
+# autosaves of existing chats, flushed on shutdown (main.lifespan)
+chat_buffer = ChatWriteBuffer(db_client, settings.CHAT_SAVE_COALESCE_MS)
 
 
 class chatData(BaseModel):
@@ -22,6 +26,8 @@ class chatData(BaseModel):
     title: Optional[str] = None
     model: Optional[str] = None
     contents: Optional[List] = None
+    # contents start at this message, None means contents is the whole history
+    start_seq: Optional[int] = None
     assistant_id: Optional[str] = None
     thread_id: Optional[str] = None
     bot_id: Optional[int] = None
@@ -39,7 +45,7 @@ async def chat_new(user_id: int, chat: chatData) -> Any:
         updated_at = int(time.time())
         if chat.id == -1:
             new_chat = True
-            chat_id = db_client.chat.add_new_chat(
+            chat_id = await db_client.chat.add_new_chat(
                 title=chat.title,
                 contents=chat.contents,
                 page_id=chat.page_id,
@@ -62,6 +68,7 @@ async def chat_new(user_id: int, chat: chatData) -> Any:
                 newdata["title"] = chat.title
             if chat.contents:
                 newdata["contents"] = chat.contents
+                newdata["start_seq"] = chat.start_seq
             if chat.model:
                 newdata["model"] = chat.model
             if chat.assistant_id:
@@ -77,7 +84,7 @@ async def chat_new(user_id: int, chat: chatData) -> Any:
             if chat.temperature != None:
                 newdata["temperature"] = chat.temperature
             newdata["updated_at"] = int(time.time())
-            chat_id = db_client.chat.update_chat_by_id(
+            chat_id = await chat_buffer.save(
                 chat.id,
                 **newdata
                 )
@@ -87,27 +94,190 @@ async def chat_new(user_id: int, chat: chatData) -> Any:
         return JSONResponse(status_code=500, content={"result": str(err)})
     userinfo = None
     if new_chat and chat.assistant_id is not None:
-        userinfo = credit.from_costs(user_id, 0.03) #every code interpreter cost $0.03
+        #every code interpreter cost $0.03
+        userinfo = await credit.from_costs(
+            user_id, 0.03, model="code_interpreter", provider="openai", chat_id=chat_id)
     # userinfo = chatlib.credit_balance(user_id, chat, new_chat)
     update_time = userinfo.updated_at if userinfo else int(time.time())
     res = {"result": "success", "id": chat_id, "updated_at": update_time}
     return JSONResponse(status_code=200, content=res)
 
 
-@router.post("/user/{user_id}/chats", name="get all chats")
-async def get_chats(user_id: int) -> Any:
+@router.post("/user/{user_id}/chats", name="get chat summaries")
+async def get_chats(
+        user_id: int,
+        before: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = Query(50, ge=1, le=200),
+        model: Optional[str] = None,
+        type: Optional[int] = Query(None, description="message type, 1 image, 2 file"),
+        role: Optional[str] = None,
+    ) -> Any:
+    """
+    one page of chats without contents, pass the returned cursor
+    (before, before_id) to get the next page.
+    model, type and role keep only the chats of that model, or with a
+    message of that type and role
+    """
+    message = {}
+    if type is not None:
+        message["type"] = type
+    if role is not None:
+        message["role"] = role
     try:
-        chats = db_client.chat.get_chat_by_user_id(user_id)
+        chats, cursor = await db_client.chat.get_chat_summaries(
+            user_id,
+            before=before,
+            before_id=before_id,
+            limit=limit,
+            model=model,
+            message=message,
+            )
     except Exception as err:
         log.debug(f"get chats error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
-    return JSONResponse(status_code=200, content={"result":"success", "chats": chats})
+    chats = [chat_buffer.overlay(chat) for chat in chats]
+    return JSONResponse(
+        status_code=200,
+        content={"result":"success", "chats": chats, "cursor": cursor})
+
+
+@router.get("/user/{user_id}/chats/sync", name="get chat changes")
+async def sync_chats(
+        user_id: int,
+        since: int,
+        since_id: Optional[int] = None,
+        limit: int = Query(200, ge=1, le=1000),
+        contents: bool = False,
+    ) -> Any:
+    """
+    chats changed and ids of chats deleted since the cursor,
+    call again with the returned cursor until "more" is false.
+    "reset" means the cursor is too old, reload all chats instead
+    """
+    try:
+        chats, deleted, cursor = await db_client.chat.get_chat_changes(
+            user_id,
+            since,
+            since_id=since_id,
+            limit=limit,
+            contents=contents,
+            )
+    except Exception as err:
+        log.debug(f"sync chats error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    res = {
+        "result": "success",
+        "chats": chats,
+        "deleted": deleted,
+        "cursor": cursor,
+        "more": bool(cursor and cursor["since_id"] is not None),
+        "reset": cursor is None,
+    }
+    return JSONResponse(status_code=200, content=res)
+
+
+@router.get("/user/{user_id}/chats/search", name="search chats")
+async def search_chats(
+        user_id: int,
+        q: str = Query(..., min_length=1, max_length=200),
+        offset: int = Query(0, ge=0),
+        limit: int = Query(20, ge=1, le=100),
+    ) -> Any:
+    """
+    chats whose title or messages contain q, best match first, each with a
+    snippet and the [start, end) offsets of the matches in it.
+    pass the returned offset to get the next page, null when there is none
+    """
+    try:
+        results, next_offset = await db_client.chat.search_chats(
+            user_id,
+            q.strip() or q,
+            offset=offset,
+            limit=limit,
+            )
+    except Exception as err:
+        log.debug(f"search chats error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    return JSONResponse(
+        status_code=200,
+        content={"result": "success", "chats": results, "offset": next_offset})
+
+
+@router.get("/user/{user_id}/chat/{chat_id}", name="get chat contents")
+async def get_chat(user_id: int, chat_id: int) -> Any:
+    try:
+        chat = await db_client.chat.get_chat_by_id(chat_id)
+    except Exception as err:
+        log.debug(f"get chat error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    if chat:
+        chat = chat_buffer.overlay(chat)
+    if not chat or chat.user_id != user_id:
+        return JSONResponse(status_code=200, content={"result": "chat not found"})
+    return JSONResponse(status_code=200, content={"result": "success", "chat": chat})
+
+
+@router.post("/user/{user_id}/chat/{chat_id}/messages", name="append chat messages")
+async def chat_append(user_id: int, chat_id: int, messages: List) -> Any:
+    try:
+        updated_at = int(time.time())
+        await chat_buffer.flush(chat_id)
+        count = await db_client.chat.append_messages(
+            chat_id,
+            messages,
+            updated_at=updated_at,
+            )
+    except Exception as err:
+        log.debug(f"append chat messages error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    res = {"result": "success", "id": chat_id, "count": count, "updated_at": updated_at}
+    return JSONResponse(status_code=200, content=res)
+
+
+class forkData(BaseModel):
+    '''
+    branch of a chat at message seq, with the messages from seq on
+    '''
+    seq: int = Field(..., ge=0)
+    contents: Optional[List] = None
+    page_id: Optional[int] = None
+    title: Optional[str] = None
+
+
+@router.post("/user/{user_id}/chat/{chat_id}/fork", name="branch chat")
+async def chat_fork(user_id: int, chat_id: int, fork: forkData) -> Any:
+    """
+    new chat sharing the messages before seq with the chat, e.g. to edit
+    a message or regenerate an answer, only the new messages are sent and
+    stored. reads return the whole history
+    """
+    try:
+        updated_at = int(time.time())
+        await chat_buffer.flush(chat_id)
+        new_id = await db_client.chat.fork_chat(
+            chat_id,
+            fork.seq,
+            user_id=user_id,
+            contents=fork.contents,
+            page_id=fork.page_id,
+            title=fork.title,
+            created_at=updated_at,
+            updated_at=updated_at,
+            )
+    except Exception as err:
+        log.debug(f"fork chat error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    if not new_id:
+        return JSONResponse(status_code=200, content={"result": "chat not found"})
+    res = {"result": "success", "id": new_id, "updated_at": updated_at}
+    return JSONResponse(status_code=200, content=res)
 
 
 @router.post("/user/{user_id}/chat/{chat_id}", name="update chat")
 async def chat_update(chat: chatData) -> Any:
     try:
-        chat = db_client.chat.update_chat_by_id(
+        chat = await db_client.chat.update_chat_by_id(
             chat_id,
             page_id=chat.page_id,
             title=chat.title,
@@ -122,9 +292,10 @@ async def chat_update(chat: chatData) -> Any:
 @router.delete("/user/{user_id}/chat/{chat_id}", name="delete chat")
 async def chat_delete(user_id: int, chat_id: int) -> Any:
     try:
-        db_client.chat.delete_chat(chat_id=chat_id)
+        chat_buffer.discard(chat_id)
+        await db_client.chat.delete_chat(chat_id=chat_id)
         user_data = {"updated_at": int(time.time())}
-        db_client.user.update_user_by_id(
+        await db_client.user.update_user_by_id(
             user_id,
             **user_data,
         )
@@ -133,3 +304,48 @@ async def chat_delete(user_id: int, chat_id: int) -> Any:
         return JSONResponse(status_code=500, content={"result": str(err)})
     res = {"result": "success", "updated_at": user_data["updated_at"]}
     return JSONResponse(status_code=200, content=res)
+
+
+class chatOp(BaseModel):
+    '''
+    one operation of a batch, "update" sets the given page_id and title
+    '''
+    op: Literal["delete", "update"]
+    id: int
+    page_id: Optional[int] = None
+    title: Optional[str] = None
+
+
+class chatBatch(BaseModel):
+    ops: List[chatOp] = Field(..., max_length=1000)
+
+
+@router.post("/user/{user_id}/chats/batch", name="delete and update chats")
+async def chats_batch(user_id: int, batch: chatBatch) -> Any:
+    """
+    apply all operations in one transaction, later updates of the same
+    chat win and deleting a chat discards its updates
+    """
+    delete = [op.id for op in batch.ops if op.op == "delete"]
+    changes = {}
+    for op in batch.ops:
+        if op.op == "update":
+            changes.setdefault(op.id, {}).update(
+                op.model_dump(include={"page_id", "title"}, exclude_none=True))
+    try:
+        for chat_id in delete:
+            chat_buffer.discard(chat_id)
+        for chat_id in changes:
+            await chat_buffer.flush(chat_id)
+        res = await db_client.chat.batch_update(
+            user_id,
+            delete=delete,
+            changes=changes,
+            updated_at=int(time.time()),
+            )
+    except Exception as err:
+        log.debug(f"batch chats error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    if not res:
+        return JSONResponse(status_code=500, content={"result": "batch failed"})
+    return JSONResponse(status_code=200, content={"result": "success", **res})
@@ -1,11 +1,12 @@
 import time
 from typing import Any, List, Dict, Optional, Annotated
-from fastapi import APIRouter, Path, Body, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Path, Body, Depends, Query, Request
 from pydantic import BaseModel
 
 from utils import assistant, log
 from api.deps import db_client
+from api.responses import JSONResponse, dump
+from api.snapshot import cached_response, etag, not_modified
 from core.security import *
 
 router = APIRouter()
@@ -37,10 +38,10 @@ async def mcp_new(mcp: McpServer, current_user = Depends(get_current_user)) -> A
         mcp_data["owner_name"] = current_user.name
         mcp_data["created_at"] = updated_at
         mcp_data["updated_at"] = updated_at
-        newmcp = db_client.mcp.add_new_mcp(
+        newmcp = await db_client.mcp.add_new_mcp(
             **mcp_data
         )
-        update_shares(updated_at)
+        await update_shares(updated_at)
     except Exception as err:
         log.debug(f"add mcp error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -48,28 +49,43 @@ async def mcp_new(mcp: McpServer, current_user = Depends(get_current_user)) -> A
 
 
 @router.get("/mcps", name="get all mcp servers config")
-async def mcp_all(current_user = Depends(get_current_user)) -> Any:
-    mcps = []
-    shares = None
+async def mcp_all(
+        request: Request,
+        after: Optional[int] = None,
+        after_id: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=500),
+        current_user = Depends(get_current_user),
+    ) -> Any:
+    """
+    one page of the servers the user owns or that are public, pass the
+    returned cursor (after, after_id) to get the next page
+    """
     try:
-        _data = db_client.mcp.get_all_mcps()
-        for m in _data:
-            if m.owner_id == current_user.id or m.is_public:
-                mcps.append(m)
-        shares = db_client.shares.get_all_shares()
+        shares = await db_client.shares.get_all_shares()
+        version = shares.get("mcp_updated")
+        # the visible servers depend on the user and the page
+        tag = etag("mcps", version, current_user.id, after, after_id, limit)
+        if not_modified(request, tag, version):
+            return cached_response(request, tag, version, b"")
+        mcps, cursor = await db_client.mcp.get_visible_mcps(
+            current_user.id,
+            after=after,
+            after_id=after_id,
+            limit=limit,
+            )
     except Exception as err:
         log.debug(f"get mcps error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
-    return JSONResponse(
-        status_code=200,
-        content={"mcps": mcps, "date": shares.get("mcp_updated")})
+    return cached_response(
+        request, tag, version,
+        dump({"mcps": mcps, "date": version, "cursor": cursor}))
 
 
 @router.get("/mcp/{mcp_id}", name="get mcp info")
 async def mcp_info(mcp_id: str) -> Any:
     mcp = None
     try:
-        mcp = db_client.mcp.get_mcp_by_id(mcp_id)
+        mcp = await db_client.mcp.get_mcp_by_id(mcp_id)
     except Exception as err:
         return JSONResponse(status_code=500, content={"result": str(err)})
     if mcp is None:
@@ -84,11 +100,11 @@ async def mcp_edit(mcp_id: str, mcp: McpServer) -> Any:
     new_data = mcp.dict()
     try:
         new_data["updated_at"] = int(time.time())
-        new_data = db_client.mcp.update_mcp_by_id(
+        new_data = await db_client.mcp.update_mcp_by_id(
             mcp_id,
             **new_data,
         )
-        update_shares(new_data["updated_at"])
+        await update_shares(new_data["updated_at"])
     except Exception as err:
         log.debug(f"edit mcp error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -98,20 +114,16 @@ async def mcp_edit(mcp_id: str, mcp: McpServer) -> Any:
 @router.delete("/mcp/{mcp_id}", name="delete mcp server")
 async def mcp_delete(mcp_id: str) -> Any:
     try:
-        db_client.mcp.delete_mcp(mcp_id=mcp_id)
-        update_shares(int(time.time()))
+        await db_client.mcp.delete_mcp(mcp_id=mcp_id)
+        await update_shares(int(time.time()))
     except Exception as err:
         log.debug(f"delete mcp error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
     return JSONResponse(status_code=200, content={"result": "success"})
 
-def update_shares(updated_at):
+async def update_shares(updated_at):
     try:
-        shared = db_client.shares.get_all_shares()
-        if shared:
-            db_client.shares.update_shares_by_id(
-                shared["id"],
-                mcp_updated=updated_at)
+        await db_client.shares.touch("mcp_updated", updated_at)
     except Exception as err:
         log.debug(f"update_shared error:{err}")
 
@@ -1,7 +1,6 @@
 from typing import Any, List, Dict, Optional
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sse_starlette.sse import EventSourceResponse
 from fastapi.responses import StreamingResponse
 import json
@@ -9,6 +8,7 @@ import asyncio
 import logging
 
 from utils import chat
+from api.responses import JSONResponse
 
 
 router = APIRouter()
@@ -26,6 +26,8 @@ class ChatCompletion(BaseModel):
     messages: List
     tools: Optional[list] = None
     temperature: Optional[float] = None
+    # recorded in UsageEvent.chat_id, a 32 bit integer
+    chat_id: Optional[int] = Field(None, ge=-1, le=2**31 - 1)
 
 
 class ModelPrompt(BaseModel):
@@ -1,6 +1,5 @@
 from typing import Any, List, Dict, Optional
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import json
 import asyncio
@@ -9,6 +8,7 @@ from bs4 import BeautifulSoup
 import logging
 
 from core.config import settings
+from api.responses import JSONResponse
 
 
 router = APIRouter()
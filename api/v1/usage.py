@@ -0,0 +1,52 @@
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, Query
+
+from utils import log
+from api.deps import db_client
+from api.responses import JSONResponse
+from core.security import verify_admin
+
+# platform wide spend and raw events of any user, admins only
+router = APIRouter(dependencies=[Depends(verify_admin)])
+log = log.Logger(__name__, clevel=log.logging.DEBUG)
+
+
+@router.get("/usage/daily", name="get daily usage")
+async def usage_daily(
+        user_id: Optional[int] = None,
+        model: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Any:
+    """
+    daily usage from the rollup tables, per model of one user if user_id
+    is given, otherwise per model of the whole platform.
+    start, end: timestamps
+    """
+    try:
+        if user_id is not None:
+            rows = await db_client.usage.get_user_daily(
+                user_id, start=start, end=end, model=model)
+        else:
+            rows = await db_client.usage.get_model_daily(
+                start=start, end=end, model=model)
+    except Exception as err:
+        log.debug(f"get daily usage error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    return JSONResponse(status_code=200, content={"result": "success", "usage": rows})
+
+
+@router.get("/usage/{user_id}/events", name="get usage events")
+async def usage_events(
+        user_id: int,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        limit: int = Query(100, ge=1, le=1000),
+    ) -> Any:
+    try:
+        events = await db_client.usage.get_usage_events(
+            user_id, start=start, end=end, limit=limit)
+    except Exception as err:
+        log.debug(f"get usage events error:{err}")
+        return JSONResponse(status_code=500, content={"result": str(err)})
+    return JSONResponse(status_code=200, content={"result": "success", "events": events})
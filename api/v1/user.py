@@ -1,7 +1,6 @@
 import time
 from typing import Any, List, Dict, Optional, Annotated
 from fastapi import APIRouter, Path, Body, Depends, Query, Response, Request
-from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 import jwt
@@ -10,7 +9,8 @@ import hashlib
 import random
 
 from utils import log
-from api.deps import db_client
+from api.deps import db_client, db_user
+from api.responses import JSONResponse
 from core.security import * #get_password_hash, verify_password, oss
 from core.config import settings
 
@@ -52,13 +52,13 @@ class UserData(BaseModel):
 @router.post("/user", name="add user")
 async def user_new(user: UserData) -> Any:
     try:
-        olduser = db_client.user.get_user_by_email(user.email)
+        olduser = await db_client.user.get_user_by_email(user.email)
         if olduser:
             return JSONResponse(status_code=200, content={"result": "user already exists"})
         hash_pwd = get_password_hash(user.pwd)
         created_at = int(time.time())
         updated_at = int(time.time())
-        user_id = db_client.user.add_new_user(
+        user_id = await db_client.user.add_new_user(
             name=user.name,
             email=user.email,
             phone=user.phone,
@@ -82,7 +82,7 @@ async def user_get(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
     ) -> Any:
     try:
-        db_user = db_client.user.get_user_by_email(form_data.username)
+        db_user = await db_client.user.get_user_by_email(form_data.username)
     except Exception as err:
         log.debug(f"get user error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -116,7 +116,7 @@ async def read_users_me(current_user = Depends(get_current_user)) -> Any:
     return JSONResponse(status_code=200, content=current_user)
 
 
-@router.post("/user/{user_id}", name="edit user")
+@router.post("/user/{user_id}", name="edit user", dependencies=[Depends(db_user)])
 async def user_edit(user_id: int, user: UserData) -> Any:
     try:
         new_data = {}
@@ -137,7 +137,7 @@ async def user_edit(user_id: int, user: UserData) -> Any:
         if user.settings:
             new_data["settings"] = user.settings
         new_data["updated_at"] = int(time.time())
-        user = db_client.user.update_user_by_id(
+        user = await db_client.user.update_user_by_id(
             user_id,
             **new_data,
             )
@@ -147,10 +147,10 @@ async def user_edit(user_id: int, user: UserData) -> Any:
     return JSONResponse(status_code=200, content={"result": "success"})
 
 
-@router.post("/user/{user_id}/info", name="get user info")
+@router.post("/user/{user_id}/info", name="get user info", dependencies=[Depends(db_user)])
 async def user_info(user_id: int) -> Any:
     try:
-        db_user = db_client.user.get_user_by_id(user_id)
+        db_user = await db_client.user.get_user_by_id(user_id)
     except Exception as err:
         return JSONResponse(status_code=500, content={"result": str(err)})
     if db_user is None:
@@ -176,12 +176,12 @@ async def user_info(user_id: int) -> Any:
 async def user_chgpwd(user_id: int, form_data: UpdatePassword) -> Any:
     try:
         new_data = {}
-        dbuser = db_client.user.get_user_by_id(user_id)
+        dbuser = await db_client.user.get_user_by_id(user_id)
         if not verify_password(form_data.current_password, dbuser.pwd):
             return JSONResponse(status_code=200, content={"result": "wrong password"})
         new_data["pwd"] = get_password_hash(form_data.new_password)
         new_data["updated_at"] = int(time.time())
-        user = db_client.user.update_user_by_id(
+        user = await db_client.user.update_user_by_id(
             user_id,
             **new_data,
             )
@@ -203,7 +203,7 @@ def user_oss_credentials(user_id: int) ->Any:
 @router.delete("/user/", name="delete user")
 async def user_delete(id: int) -> Any:
     try:
-        user_id = db_client.user.delete_user(
+        user_id = await db_client.user.delete_user(
             user_id=id,
             )
     except Exception as err:
@@ -215,7 +215,7 @@ async def user_delete(id: int) -> Any:
 @router.post("/users", name="get all users")
 async def get_all_users() -> Any:
     try:
-        users = db_client.user.get_all_users()
+        users = await db_client.user.get_all_users()
     except Exception as err:
         log.debug(f"get all users error:{err}")
         return JSONResponse(status_code=500, content={"result": str(err)})
@@ -225,16 +225,10 @@ async def get_all_users() -> Any:
 @router.post("/user/charge/{user_id}", name="charge for user")
 async def user_edit(user_id: int, account: float) -> Any:
     try:
-        db_user = db_client.user.get_user_by_id(user_id)
-        new_data = {}
-        if db_user.credit:
-            new_data["credit"] = db_user.credit + account
-        else:
-            new_data["credit"] = account
-        new_data["updated_at"] = int(time.time())
-        user = db_client.user.update_user_by_id(
+        user = await db_client.user.add_credit_by_id(
             user_id,
-            **new_data,
+            account,
+            int(time.time()),
             )
     except Exception as err:
         log.debug(f"edit user error:{err}")
@@ -251,7 +245,9 @@ async def new_order(
         current_user = Depends(get_current_user),
     ):
     try:
-        out_trade_no = str(current_user["id"]) + time.strftime('%Y%m%d') + str(random.randint(1000, 9999))
+        # out_trade_no is unique, a per second stamp and 6 random digits keep
+        # one user's orders apart
+        out_trade_no = str(current_user["id"]) + time.strftime('%Y%m%d%H%M%S') + str(random.randint(100000, 999999))
         params = {
             "money": format_val(money),
             "name": name,
@@ -280,7 +276,7 @@ async def new_order(
             "created_at": created_at,
             "updated_at": created_at,
         }
-        db_client.order.add_new_order(**data)
+        await db_client.order.add_new_order(**data)
         return JSONResponse(status_code=200, content={"url": pay_url})
     except Exception as err:
         log.error(f"failed to get pay url: {err}")
@@ -301,24 +297,25 @@ async def charge_notify(request: Request) -> str:
         trade_status = params.get("trade_status")
         type = params.get("type")
     
-        od = db_client.order.get_order_by_out_trade_no(out_trade_no)
-        if od.status == 1:
-            #this is a repeated notify
-            log.error(f"notify repeated")
-            return Response(content="success", media_type="text/plain")
-
         calc_sign = get_zpay_sign(params, settings.order_pkey)
         if sign != calc_sign:
             log.error(f"sign check failed")
             return Response(content="sign error", media_type="text/plain")
 
-        if format_val(od.money) != format_val(money):
-            log.error(f"money check failed")
-            return Response(content="money error", media_type="text/plain")
         if trade_status == "TRADE_SUCCESS":
-            user = db_client.user.get_user_by_id(od.user_id)
-            db_client.user.update_user_by_id(user.id, credit=user.credit+float(money))
-            db_client.order.update_order_by_id(od.id, status=1)
+            result, od = await db_client.order.complete_order(
+                out_trade_no,
+                float(money),
+                check_money=lambda od_money: format_val(od_money) == format_val(money),
+                )
+            if result == "repeated":
+                log.error(f"notify repeated")
+            elif result == "money_error":
+                log.error(f"money check failed")
+                return Response(content="money error", media_type="text/plain")
+            elif result != "success":
+                log.error(f"notify order {out_trade_no}: {result}")
+                return Response(content="failed", media_type="text/plain")
         return Response(content="success", media_type="text/plain")
     except Exception as err:
         log.error(f"failed for notify recheck: {err}")
@@ -0,0 +1,177 @@
+'''
+helpers shared by the db benchmarks: synthetic data and latency stats.
+seed() writes explicit ids, point it at a scratch database, not production.
+'''
+import random
+import string
+import time
+import uuid
+
+from sqlalchemy import func, insert, select
+from sqlalchemy import text as text_sql
+
+from db.model import Base, User, Chat, ChatMessage, Bot, McpServer, Order
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))]
+
+
+def measure(fn, args_list):
+    '''
+    call fn once per args tuple, return latencies in ms
+    '''
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summary(samples):
+    total = sum(samples)
+    return {
+        "n": len(samples),
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99),
+        "ops": len(samples) / (total / 1000) if total else 0.0,
+    }
+
+
+def print_table(title, rows):
+    '''
+    rows: list of (name, summary) or (name, before summary, after summary)
+    '''
+    print(f"\n== {title}")
+    compare = rows and len(rows[0]) == 3
+    if compare:
+        print(f"{'query':<40}{'p50 before':>12}{'p99 before':>12}{'p50 after':>12}{'p99 after':>12}")
+        for name, before, after in rows:
+            print(f"{name:<40}{before['p50']:>12.3f}{before['p99']:>12.3f}"
+                  f"{after['p50']:>12.3f}{after['p99']:>12.3f}")
+    else:
+        print(f"{'query':<40}{'n':>8}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}")
+        for name, stat in rows:
+            print(f"{name:<40}{stat['n']:>8}{stat['p50']:>10.3f}{stat['p99']:>10.3f}{stat['ops']:>12.1f}")
+
+
+def text(size):
+    return "".join(random.choices(string.ascii_letters + " " * 10, k=size))
+
+
+def message(role, size):
+    return {"role": role, "type": 0, "content": text(size)}
+
+
+def _next_id(conn, tbl):
+    return (conn.execute(select(func.max(tbl.id))).scalar() or 0) + 1
+
+
+def _insert(conn, tbl, rows, batch):
+    for i in range(0, len(rows), batch):
+        conn.execute(insert(tbl), rows[i:i + batch])
+
+
+def seed(engine, users=1000, chats_per_user=20, messages_per_chat=6,
+         message_size=600, bots_per_user=0.1, mcps_per_user=0.1,
+         orders_per_user=1, batch=5000):
+    '''
+    create the tables if needed and insert a synthetic dataset,
+    return the keys benchmarks use for lookups
+    '''
+    Base.metadata.create_all(engine)
+    now = int(time.time())
+    keys = {"user_ids": [], "emails": [], "chat_ids": [], "out_trade_nos": [],
+            "author_ids": [], "owner_ids": []}
+    with engine.begin() as conn:
+        user_id = _next_id(conn, User)
+        chat_id = _next_id(conn, Chat)
+        bot_id = _next_id(conn, Bot)
+        order_id = _next_id(conn, Order)
+        msg_id = _next_id(conn, ChatMessage)
+        user_rows, chat_rows, msg_rows = [], [], []
+        bot_rows, mcp_rows, order_rows = [], [], []
+        for _ in range(users):
+            email = f"{uuid.uuid4().hex[:12]}@bench.local"
+            user_rows.append({
+                "id": user_id, "name": email[:8], "email": email, "pwd": "x" * 60,
+                "credit": 100.0, "active": True, "settings": {},
+                "created_at": now, "updated_at": now,
+            })
+            keys["user_ids"].append(user_id)
+            keys["emails"].append(email)
+            for _ in range(chats_per_user):
+                updated_at = now - random.randint(0, 90 * 24 * 3600)
+                chat_rows.append({
+                    "id": chat_id, "user_id": user_id, "page_id": -1, "title": text(20),
+                    "model": "gpt-4o", "created_at": updated_at, "updated_at": updated_at,
+                    "artifact": False, "internet": False,
+                })
+                for seq in range(messages_per_chat):
+                    role = "user" if seq % 2 == 0 else "assistant"
+                    msg_rows.append({
+                        "id": msg_id, "chat_id": chat_id, "seq": seq, "role": role,
+                        "content": message(role, message_size), "created_at": updated_at,
+                    })
+                    msg_id += 1
+                keys["chat_ids"].append(chat_id)
+                chat_id += 1
+            if random.random() < bots_per_user:
+                bot_rows.append({
+                    "id": bot_id, "name": text(10), "instructions": text(200),
+                    "model": "gpt-4o", "author_id": user_id, "author_name": email[:8],
+                    "public": True, "created_at": now, "updated_at": now,
+                })
+                keys["author_ids"].append(user_id)
+                bot_id += 1
+            if random.random() < mcps_per_user:
+                mcp_rows.append({
+                    "id": str(uuid.uuid4()), "name": text(10), "command": "npx",
+                    "args": text(40), "custom_environment": {}, "owner_id": user_id,
+                    "owner_name": email[:8], "is_public": random.random() < 0.2,
+                    "created_at": now, "updated_at": now,
+                })
+                keys["owner_ids"].append(user_id)
+            for _ in range(orders_per_user):
+                out_trade_no = f"{user_id}{uuid.uuid4().hex[:12]}"
+                order_rows.append({
+                    "id": order_id, "user_id": user_id, "name": "credit",
+                    "out_trade_no": out_trade_no, "type": "alipay", "pid": "1",
+                    "money": "10.00", "status": 1, "created_at": now, "updated_at": now,
+                })
+                keys["out_trade_nos"].append(out_trade_no)
+                order_id += 1
+            user_id += 1
+        _insert(conn, User, user_rows, batch)
+        _insert(conn, Chat, chat_rows, batch)
+        _insert(conn, ChatMessage, msg_rows, batch)
+        _insert(conn, Bot, bot_rows, batch)
+        _insert(conn, McpServer, mcp_rows, batch)
+        _insert(conn, Order, order_rows, batch)
+        if conn.dialect.name == "postgresql":
+            for tbl in (User, Chat, ChatMessage, Bot, Order):
+                conn.execute(text_sql(
+                    f"SELECT setval(pg_get_serial_sequence('\"{tbl.__tablename__}\"', 'id'), "
+                    f"(SELECT max(id) FROM \"{tbl.__tablename__}\"))"))
+    return keys
+
+
+def load_keys(engine, limit=10000):
+    '''
+    lookup keys from an already seeded database
+    '''
+    with engine.connect() as conn:
+        def column(col):
+            return [x for x, in conn.execute(select(col).where(col.isnot(None)).limit(limit))]
+        return {
+            "user_ids": column(User.id),
+            "emails": column(User.email),
+            "chat_ids": column(Chat.id),
+            "out_trade_nos": column(Order.out_trade_no),
+            "author_ids": column(Bot.author_id),
+            "owner_ids": column(McpServer.owner_id),
+        }
@@ -49,6 +49,35 @@ class Settings(BaseSettings):
     POSTGRES_USER: str = 'postgres'
     POSTGRES_PASSWORD: str = ''
     POSTGRES_DB: str = ''
+    # "sqlite" runs on the SQLITE_PATH file (or :memory:), the tables are
+    # created on startup, for local development without postgres
+    DB_BACKEND: Literal["postgresql", "sqlite"] = "postgresql"
+    SQLITE_PATH: str = "mychat.db"
+    # read replicas, postgresql+asyncpg:// urls as a json list
+    REPLICA_DATABASE_URIS: list[str] = []
+
+    # component calls slower than this are logged, 0 disables the log
+    DB_SLOW_QUERY_MS: int = 500
+
+    # saves of the same chat within this window are written once, the buffer
+    # is per process: route a user to one worker, or set 0 to write directly
+    CHAT_SAVE_COALESCE_MS: int = 1000
+
+    # blob store of archived chat messages, a directory, file:///path or
+    # oss://bucket/prefix (with the oss_* keys), empty disables archiving
+    ARCHIVE_URL: str = ''
+    # chats not updated for that many days are archived, checked every
+    # ARCHIVE_INTERVAL seconds. search only matches the start of archived
+    # messages, see ChatDBConnectorComponent.archive_chats
+    ARCHIVE_AFTER_DAYS: int = 90
+    ARCHIVE_INTERVAL: int = 3600
+
+    # X-Admin-Token of the export/import endpoints, empty disables them
+    ADMIN_TOKEN: str = ''
+
+    # token usage is charged in batches, whichever comes first
+    USAGE_FLUSH_MS: int = 500
+    USAGE_FLUSH_EVENTS: int = 200
 
     @computed_field  # type: ignore[misc]
     @property
@@ -62,4 +91,16 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )
 
+    @computed_field  # type: ignore[misc]
+    @property
+    def SQLALCHEMY_ASYNC_DATABASE_URI(self) -> PostgresDsn:
+        return MultiHostUrl.build(
+            scheme="postgresql+asyncpg",
+            username=self.POSTGRES_USER,
+            password=self.POSTGRES_PASSWORD,
+            host=self.POSTGRES_SERVER,
+            port=self.POSTGRES_PORT,
+            path=self.POSTGRES_DB,
+        )
+
 settings = Settings()
\ No newline at end of file
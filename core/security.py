@@ -1,10 +1,11 @@
 from datetime import datetime, timedelta
 from typing import Any, List
+import secrets
 
 import jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from alibabacloud_sts20150401.client import Client as Sts20150401Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_sts20150401 import models as sts_20150401_models
@@ -45,12 +46,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except Exception as e:
         raise credentials_exception
-    user = db_client.user.get_user_by_id(user_id)
+    user = await db_client.user.get_user_by_id(user_id)
     if user is None:
         raise credentials_exception
     return user
 
 
+async def verify_admin(x_admin_token: str = Header(default="")):
+    if not settings.ADMIN_TOKEN or not secrets.compare_digest(
+            x_admin_token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="admin token required",
+        )
+
+
 class OSS:
     def __init__(self):
         self.client = self.create_client()
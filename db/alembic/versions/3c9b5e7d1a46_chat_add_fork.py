@@ -0,0 +1,42 @@
+"""chat add fork
+
+Revision ID: 3c9b5e7d1a46
+Revises: 7a3e9c1f5b28
+Create Date: 2026-10-18 18:22:07.415830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9b5e7d1a46'
+down_revision: Union[str, None] = '7a3e9c1f5b28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('Chat', sa.Column('parent_id', sa.Integer(), nullable=True,
+                                    comment='chat this one branches off'))
+    op.add_column('Chat', sa.Column('fork_seq', sa.Integer(), nullable=True,
+                                    comment="messages before this seq are the parent's"))
+    # validated separately, so the scan of Chat does not block writes
+    op.execute('ALTER TABLE "Chat" ADD CONSTRAINT "Chat_parent_id_fkey" '
+               'FOREIGN KEY (parent_id) REFERENCES "Chat" (id) NOT VALID')
+    op.execute('ALTER TABLE "Chat" VALIDATE CONSTRAINT "Chat_parent_id_fkey"')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chat_parent_id', 'Chat', ['parent_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    # branches keep only their own messages, materialize them before
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_parent_id', table_name='Chat',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_constraint('Chat_parent_id_fkey', 'Chat', type_='foreignkey')
+    op.drop_column('Chat', 'fork_seq')
+    op.drop_column('Chat', 'parent_id')
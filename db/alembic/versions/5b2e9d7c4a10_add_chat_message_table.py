@@ -0,0 +1,59 @@
+"""add chat message table
+
+Revision ID: 5b2e9d7c4a10
+Revises: c0e1e961112f
+Create Date: 2026-10-18 09:12:30.514208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e9d7c4a10'
+down_revision: Union[str, None] = 'c0e1e961112f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('ChatMessage',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False, comment='position of the message in the chat'),
+    sa.Column('role', sa.String(length=20), nullable=True, comment='message role'),
+    sa.Column('content', sa.JSON(), nullable=True, comment='the message as sent by the client'),
+    sa.Column('input_tokens', sa.Integer(), nullable=True),
+    sa.Column('output_tokens', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['chat_id'], ['Chat.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('chat_id', 'seq', name='uq_chat_message_chat_id_seq')
+    )
+    op.create_index(op.f('ix_ChatMessage_id'), 'ChatMessage', ['id'], unique=False)
+    # split every chat's contents array into one row per message
+    op.execute('''
+        INSERT INTO "ChatMessage" (chat_id, seq, role, content, created_at)
+        SELECT c.id, m.ordinality - 1, m.value ->> 'role', m.value, c.updated_at
+        FROM "Chat" c, json_array_elements(c.contents) WITH ORDINALITY AS m(value, ordinality)
+        WHERE c.contents IS NOT NULL AND json_typeof(c.contents) = 'array'
+    ''')
+    op.execute('''
+        UPDATE "Chat" SET contents = NULL
+        WHERE contents IS NOT NULL AND json_typeof(contents) = 'array'
+    ''')
+
+
+def downgrade() -> None:
+    op.execute('''
+        UPDATE "Chat" c SET contents = m.contents
+        FROM (
+            SELECT chat_id, json_agg(content ORDER BY seq) AS contents
+            FROM "ChatMessage" GROUP BY chat_id
+        ) m
+        WHERE c.id = m.chat_id
+    ''')
+    op.drop_index(op.f('ix_ChatMessage_id'), table_name='ChatMessage')
+    op.drop_table('ChatMessage')
@@ -0,0 +1,32 @@
+"""add mcp public index
+
+Revision ID: 6f0b2d9a4c73
+Revises: 3c8d1f6a9e47
+Create Date: 2026-10-18 14:05:12.207561
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f0b2d9a4c73'
+down_revision: Union[str, None] = '3c8d1f6a9e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # public servers in listing order, owned ones come from ix_mcp_owner_id
+    with op.get_context().autocommit_block():
+        op.create_index('ix_mcp_public_created_at', 'mcp', ['created_at', 'id'],
+                        unique=False, postgresql_where=sa.text('is_public'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_mcp_public_created_at', table_name='mcp',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,28 @@
+"""chat add archive
+
+Revision ID: 7a3e9c1f5b28
+Revises: f2c6a8d4b317
+Create Date: 2026-10-18 17:41:26.093518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a3e9c1f5b28'
+down_revision: Union[str, None] = 'f2c6a8d4b317'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('Chat', sa.Column('archive', sa.String(), nullable=True,
+                                    comment='blob key of the archived messages'))
+
+
+def downgrade() -> None:
+    # archived messages have to be rehydrated before, the keys are lost here
+    op.drop_column('Chat', 'archive')
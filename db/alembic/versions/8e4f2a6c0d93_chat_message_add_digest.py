@@ -0,0 +1,28 @@
+"""chat message add digest
+
+Revision ID: 8e4f2a6c0d93
+Revises: 3c9b5e7d1a46
+Create Date: 2026-10-19 09:12:44.208315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4f2a6c0d93'
+down_revision: Union[str, None] = '3c9b5e7d1a46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # not backfilled, saves hash the content of rows without one
+    op.add_column('ChatMessage', sa.Column('digest', sa.String(length=32), nullable=True,
+                                           comment='md5 of the message json, to find what a save changed'))
+
+
+def downgrade() -> None:
+    op.drop_column('ChatMessage', 'digest')
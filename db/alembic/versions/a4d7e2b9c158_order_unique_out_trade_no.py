@@ -0,0 +1,45 @@
+"""order unique out_trade_no
+
+Revision ID: a4d7e2b9c158
+Revises: 6f0b2d9a4c73
+Create Date: 2026-10-18 14:52:37.640815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d7e2b9c158'
+down_revision: Union[str, None] = '6f0b2d9a4c73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # older order numbers could collide, keep the paid (or first) order
+    # under its number and suffix the others with their id
+    op.execute('''
+        UPDATE "order" o SET out_trade_no = o.out_trade_no || '-' || o.id
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY out_trade_no ORDER BY status DESC, id) AS rn
+            FROM "order"
+        ) d
+        WHERE o.id = d.id AND d.rn > 1
+    ''')
+    with op.get_context().autocommit_block():
+        op.create_index('uq_order_out_trade_no', 'order', ['out_trade_no'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_order_out_trade_no', table_name='order',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_order_out_trade_no', 'order', ['out_trade_no'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('uq_order_out_trade_no', table_name='order',
+                      postgresql_concurrently=True, if_exists=True)
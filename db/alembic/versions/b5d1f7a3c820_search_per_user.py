@@ -0,0 +1,69 @@
+"""search per user
+
+Revision ID: b5d1f7a3c820
+Revises: 8e4f2a6c0d93
+Create Date: 2026-10-19 10:03:51.772640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d1f7a3c820'
+down_revision: Union[str, None] = '8e4f2a6c0d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 10000
+
+
+def upgrade() -> None:
+    op.add_column('ChatMessage', sa.Column('user_id', sa.Integer(), nullable=True,
+                                           comment='Chat.user_id, so search is indexed per user'))
+    with op.get_context().autocommit_block():
+        # integer columns in the same GIN index as the trigrams
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+        bind = op.get_bind()
+        last_id = bind.execute(sa.text('SELECT coalesce(max(id), 0) FROM "ChatMessage"')).scalar()
+        for start in range(0, last_id, BATCH):
+            op.execute(sa.text('''
+                UPDATE "ChatMessage" m SET user_id = c.user_id FROM "Chat" c
+                WHERE c.id = m.chat_id AND m.id > :start AND m.id <= :end AND m.user_id IS NULL
+            ''').bindparams(start=start, end=start + BATCH))
+        # messages the previous release saved meanwhile
+        op.execute(sa.text('''
+            UPDATE "ChatMessage" m SET user_id = c.user_id FROM "Chat" c
+            WHERE c.id = m.chat_id AND m.id > :start AND m.user_id IS NULL
+        ''').bindparams(start=last_id))
+        op.create_index('ix_chat_message_user_id_search_text_trgm', 'ChatMessage',
+                        ['user_id', 'search_text'], unique=False, postgresql_using='gin',
+                        postgresql_ops={'search_text': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_chat_user_id_title_trgm', 'Chat', ['user_id', 'title'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_chat_message_search_text_trgm', table_name='ChatMessage',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_title_trgm', table_name='Chat',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chat_message_search_text_trgm', 'ChatMessage', ['search_text'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'search_text': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_chat_title_trgm', 'Chat', ['title'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_chat_user_id_title_trgm', table_name='Chat',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_message_user_id_search_text_trgm', table_name='ChatMessage',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('ChatMessage', 'user_id')
@@ -0,0 +1,43 @@
+"""chat backfill updated_at
+
+Revision ID: d6a2c8e4f175
+Revises: b5d1f7a3c820
+Create Date: 2026-10-20 11:26:07.513904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6a2c8e4f175'
+down_revision: Union[str, None] = 'b5d1f7a3c820'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 10000
+
+
+def upgrade() -> None:
+    # legacy chats without updated_at sort first under DESC on postgres,
+    # a summary page ending on one returned a null cursor (a restart)
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = bind.execute(sa.text('SELECT coalesce(max(id), 0) FROM "Chat"')).scalar()
+        for start in range(0, last_id, BATCH):
+            op.execute(sa.text('''
+                UPDATE "Chat" SET updated_at = coalesce(created_at, 0)
+                WHERE id > :start AND id <= :end AND updated_at IS NULL
+            ''').bindparams(start=start, end=start + BATCH))
+        # chats the previous release saved meanwhile
+        op.execute(sa.text('''
+            UPDATE "Chat" SET updated_at = coalesce(created_at, 0)
+            WHERE id > :start AND updated_at IS NULL
+        ''').bindparams(start=last_id))
+
+
+def downgrade() -> None:
+    # which chats had no updated_at is not kept, they keep the backfilled one
+    pass
@@ -0,0 +1,60 @@
+"""add chat search
+
+Revision ID: d81f4b6e2a95
+Revises: a4d7e2b9c158
+Create Date: 2026-10-18 16:20:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81f4b6e2a95'
+down_revision: Union[str, None] = 'a4d7e2b9c158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 10000
+
+
+def upgrade() -> None:
+    op.add_column('ChatMessage', sa.Column('search_text', sa.Text(), nullable=True,
+                                           comment='plain text of the message for search'))
+    with op.get_context().autocommit_block():
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # same text as ChatDBConnectorComponent._text, in short transactions
+        bind = op.get_bind()
+        last_id = bind.execute(sa.text('SELECT coalesce(max(id), 0) FROM "ChatMessage"')).scalar()
+        for start in range(0, last_id, BATCH):
+            op.execute(sa.text('''
+                UPDATE "ChatMessage" SET search_text = nullif(left(CASE
+                    WHEN json_typeof(content) = 'string' THEN content #>> '{}'
+                    WHEN json_typeof(content) <> 'object' THEN NULL
+                    WHEN json_typeof(content->'content') = 'string' THEN content->>'content'
+                    WHEN json_typeof(content->'content') = 'array' THEN (
+                        SELECT string_agg(part->>'text', ' ')
+                        FROM json_array_elements(content->'content') part
+                        WHERE json_typeof(part) = 'object' AND part->>'text' <> '')
+                    END, 10000), '')
+                WHERE id > :start AND id <= :end
+            ''').bindparams(start=start, end=start + BATCH))
+        op.create_index('ix_chat_message_search_text_trgm', 'ChatMessage', ['search_text'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'search_text': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_chat_title_trgm', 'Chat', ['title'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_title_trgm', table_name='Chat',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_message_search_text_trgm', table_name='ChatMessage',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('ChatMessage', 'search_text')
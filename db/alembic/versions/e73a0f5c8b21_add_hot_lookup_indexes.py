@@ -0,0 +1,43 @@
+"""add hot lookup indexes
+
+Revision ID: e73a0f5c8b21
+Revises: 9e41c3b7d2f5
+Create Date: 2026-10-18 11:20:44.918302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e73a0f5c8b21'
+down_revision: Union[str, None] = '9e41c3b7d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_chat_user_id_updated_at', 'Chat', ['user_id', 'updated_at']),
+    ('ix_user_email', 'User', ['email']),
+    ('ix_order_out_trade_no', 'order', ['out_trade_no']),
+    ('ix_bot_author_id', 'Bot', ['author_id']),
+    ('ix_mcp_owner_id', 'mcp', ['owner_id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the tables writable while the indexes build,
+    # it can not run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,104 @@
+"""json to jsonb
+
+Revision ID: f2c6a8d4b317
+Revises: d81f4b6e2a95
+Create Date: 2026-10-18 16:58:09.554102
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c6a8d4b317'
+down_revision: Union[str, None] = 'd81f4b6e2a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 5000
+
+# large tables, converted without rewriting them under an exclusive lock:
+# a jsonb copy kept in sync by a trigger is backfilled in batches, then
+# swapped in with a catalog only change
+ONLINE = [
+    ('ChatMessage', 'content', 'the message as sent by the client'),
+    ('Chat', 'contents', 'chat content of this title'),
+    ('User', 'settings', 'user settings'),
+]
+# catalogs small enough to rewrite in place
+IN_PLACE = [
+    ('Bot', 'vector_store_ids'),
+    ('Bot', 'code_interpreter_files'),
+    ('Bot', 'functions'),
+    ('mcp', 'custom_environment'),
+]
+
+
+def _copy(table, column):
+    new = f'{column}__jsonb'
+    func = f'{table}_{column}_to_jsonb'.lower()
+    op.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{new}" jsonb')
+    op.execute(f'''
+        CREATE OR REPLACE FUNCTION {func}() RETURNS trigger AS $$
+        BEGIN
+            NEW."{new}" := NEW."{column}"::jsonb;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql
+    ''')
+    op.execute(f'DROP TRIGGER IF EXISTS {func} ON "{table}"')
+    op.execute(f'''
+        CREATE TRIGGER {func} BEFORE INSERT OR UPDATE OF "{column}" ON "{table}"
+        FOR EACH ROW EXECUTE FUNCTION {func}()
+    ''')
+    # rows written from now on are copied by the trigger
+    last_id = op.get_bind().execute(
+        sa.text(f'SELECT coalesce(max(id), 0) FROM "{table}"')).scalar()
+    for start in range(0, last_id, BATCH):
+        op.execute(sa.text(f'''
+            UPDATE "{table}" SET "{new}" = "{column}"::jsonb
+            WHERE id > :start AND id <= :end AND "{column}" IS NOT NULL AND "{new}" IS NULL
+        ''').bindparams(start=start, end=start + BATCH))
+
+
+def _swap(table, column, comment):
+    new = f'{column}__jsonb'
+    func = f'{table}_{column}_to_jsonb'.lower()
+    op.execute(f'DROP TRIGGER {func} ON "{table}"')
+    op.execute(f'DROP FUNCTION {func}()')
+    op.execute(f'ALTER TABLE "{table}" DROP COLUMN "{column}"')
+    op.execute(f'ALTER TABLE "{table}" RENAME COLUMN "{new}" TO "{column}"')
+    comment = comment.replace("'", "''")
+    op.execute(f'COMMENT ON COLUMN "{table}"."{column}" IS \'{comment}\'')
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table, column, _ in ONLINE:
+            _copy(table, column)
+    # the swaps only touch the catalog, but their locks wait for running
+    # queries and every new query would queue behind them. give up instead,
+    # the migration can be run again
+    op.execute("SET LOCAL lock_timeout = '10s'")
+    for table, column, comment in ONLINE:
+        _swap(table, column, comment)
+    for table, column in IN_PLACE:
+        op.alter_column(table, column, type_=postgresql.JSONB(),
+                        postgresql_using=f'"{column}"::jsonb')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chat_message_content_gin', 'ChatMessage', ['content'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'content': 'jsonb_path_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_message_content_gin', table_name='ChatMessage',
+                      postgresql_concurrently=True, if_exists=True)
+    for table, column, _ in ONLINE:
+        op.alter_column(table, column, type_=sa.JSON(), postgresql_using=f'"{column}"::json')
+    for table, column in IN_PLACE:
+        op.alter_column(table, column, type_=sa.JSON(), postgresql_using=f'"{column}"::json')
@@ -1,3 +1,13 @@
+from sqlalchemy import and_, insert, select, text, type_coerce
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+class NeedsOffload(Exception):
+    '''
+    a component closure needs blocking work done outside of it first (see
+    DBClient.offload), the call is rolled back and not counted as an error
+    '''
+
 
 class DBConnectorComponent:
     '''A fixed component of the DBConnector, handling one particular aspect of
@@ -5,6 +15,104 @@ class DBConnectorComponent:
     '''
 
     connector = None
+    EXPORT_BATCH = 1000
 
     def __init__(self, connector):
         self.db = connector
+
+    def _columns(self, *exclude, tbl=None):
+        tbl = tbl if tbl is not None else self.tbl
+        return [c for c in tbl.__table__.columns if c.name not in exclude]
+
+    def _rows(self, conn, stmt):
+        '''
+        plain dicts straight from a Core select, for list reads that do not
+        need ORM objects or Namespace
+        '''
+        return [dict(row) for row in conn.execute(stmt).mappings()]
+
+    def _json_contains(self, conn, column, value):
+        '''
+        condition: the json column holds an object containing value.
+        jsonb @> on postgres, served by a GIN index on the column, elsewhere
+        the top level keys of value are compared one by one
+        '''
+        if conn.get_bind().dialect.name == "postgresql":
+            return type_coerce(column, postgresql.JSONB).contains(value)
+        clauses = []
+        for key, val in value.items():
+            if isinstance(val, bool):
+                clauses.append(column[key].as_boolean() == val)
+            elif isinstance(val, int):
+                clauses.append(column[key].as_integer() == val)
+            elif isinstance(val, float):
+                clauses.append(column[key].as_float() == val)
+            elif isinstance(val, str):
+                clauses.append(column[key].as_string() == val)
+            else:
+                raise ValueError(f"{key}: only scalar values can be matched")
+        return and_(*clauses)
+
+    def export(self, *where, since=None, after_id=None, batch=None, tbl=None):
+        '''
+        stream rows of the table as lists of row mappings, ordered by id,
+        through a server side cursor so memory does not grow with the table
+        since: rows updated (or created) at or after this timestamp
+        after_id: resume after the last id of an interrupted export
+        '''
+        tbl = tbl if tbl is not None else self.tbl
+        stmt = select(tbl.__table__).where(*where)
+        if since is not None:
+            stamp = tbl.updated_at if hasattr(tbl, "updated_at") else tbl.created_at
+            stmt = stmt.where(stamp >= since)
+        if after_id is not None:
+            stmt = stmt.where(tbl.id > after_id)
+        return self.db.stream(stmt.order_by(tbl.id), batch or self.EXPORT_BATCH)
+
+    def import_rows(self, rows, tbl=None, skip_existing=True):
+        '''
+        insert one batch of exported rows in one multi-row INSERT and one
+        transaction, ids are kept.
+        skip_existing: rows whose key already exists are skipped instead of
+            failing the batch, so an import can be run again
+        return: {"inserted": n} or {"error": message} if the batch was rolled back
+        '''
+        tbl = tbl if tbl is not None else self.tbl
+        columns = tbl.__table__.columns.keys()
+        rows = [{col: row.get(col) for col in columns} for row in rows]
+        def thd(conn):
+            dialect = conn.get_bind().dialect.name
+            if skip_existing and dialect == "postgresql":
+                stmt = postgresql.insert(tbl.__table__).on_conflict_do_nothing()
+            elif skip_existing and dialect == "sqlite":
+                stmt = sqlite.insert(tbl.__table__).on_conflict_do_nothing()
+            else:
+                stmt = insert(tbl.__table__)
+            try:
+                # skipped rows return nothing, so count the ids
+                inserted = conn.connection().execute(
+                    stmt.returning(tbl.__table__.c.id), rows).all()
+                conn.commit()
+            except Exception as err:
+                conn.rollback()
+                return {"error": str(err).split("\n")[0]}
+            return {"inserted": len(inserted)}
+        d = self.db.execute(thd)
+        return d
+
+    def reset_id_sequence(self, tbl=None):
+        '''
+        move the postgres id sequence past imported ids
+        '''
+        tbl = tbl if tbl is not None else self.tbl
+        def thd(conn):
+            if conn.get_bind().dialect.name != "postgresql":
+                return None
+            name = tbl.__tablename__
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{name}\"', 'id'), "
+                f"coalesce((SELECT max(id) FROM \"{name}\"), 1))"))
+            conn.commit()
+            return name
+        d = self.db.execute(thd)
+        return d
@@ -0,0 +1,94 @@
+import os
+import tempfile
+
+from urllib.parse import urlparse
+
+
+class LocalBlobStore:
+    '''
+    blobs as files under root, keys are relative paths.
+    writes go to a temporary file first, a key is either absent or complete
+    '''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"invalid blob key {key}")
+        return path
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, key):
+        '''
+        return: the bytes, None if there is no such key
+        '''
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class OSSBlobStore:
+    '''
+    the same interface on an aliyun OSS bucket, needs the oss2 package
+    '''
+
+    def __init__(self, bucket, endpoint, access_key, access_key_secret, prefix=""):
+        try:
+            import oss2
+        except ImportError as err:
+            raise ValueError(f"blob store oss://{bucket} needs the oss2 package") from err
+
+        self.bucket = oss2.Bucket(oss2.Auth(access_key, access_key_secret), endpoint, bucket)
+        self.prefix = prefix
+        self.NoSuchKey = oss2.exceptions.NoSuchKey
+
+    def put(self, key, data):
+        self.bucket.put_object(self.prefix + key, data)
+
+    def get(self, key):
+        try:
+            return self.bucket.get_object(self.prefix + key).read()
+        except self.NoSuchKey:
+            return None
+
+    def delete(self, key):
+        self.bucket.delete_object(self.prefix + key)
+
+
+def create_blob_store(url, **oss_options):
+    '''
+    url: file:///abs/path, a plain (relative) path, or oss://bucket/prefix
+    oss_options: endpoint, access_key, access_key_secret, only used for oss
+    '''
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "oss":
+        prefix = parsed.path.strip("/")
+        return OSSBlobStore(parsed.netloc, prefix=prefix + "/" if prefix else "", **oss_options)
+    if parsed.scheme == "file":
+        return LocalBlobStore(parsed.path)
+    if parsed.scheme:
+        raise ValueError(f"unsupported blob store {url}")
+    return LocalBlobStore(url)
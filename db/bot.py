@@ -1,3 +1,4 @@
+from sqlalchemy import select
 from sqlalchemy.orm.attributes import flag_modified
 from db.base import DBConnectorComponent
 from db.model import Bot
@@ -11,23 +12,15 @@ class BotDBConnectorComponent(DBConnectorComponent):
 
     def get_all_bots(self):
         def thd(conn):
-            try:
-                bots = conn.query(self.tbl).order_by(self.tbl.created_at).all()
-            except Exception as err:
-                print(f"get all bots err: {err}")
-            return [bot.to_dict() for bot in bots]
+            return self._rows(conn, select(*self._columns()).order_by(self.tbl.created_at))
         d = self.db.execute(thd)
         return d
 
     def get_bot_by_author_id(self, author_id):
         def thd(conn):
-            try:
-                bots = conn.query(self.tbl).filter(
-                    self.tbl.author_id == author_id).all()
-            except Exception as err:
-                print(f"get bot err: {err}")
-            return [bot.to_dict() for bot in bots]
-        d = self.db.execute(thd)
+            return self._rows(conn, select(*self._columns()).where(
+                self.tbl.author_id == author_id))
+        d = self.db.read(thd)
         return d
 
     def get_bot_by_id(self, bot_id):
@@ -35,7 +28,7 @@ class BotDBConnectorComponent(DBConnectorComponent):
             bot = conn.query(self.tbl).filter(
                 self.tbl.id == bot_id).first()
             return bot.to_dict() if bot else None
-        d = self.db.execute(thd)
+        d = self.db.read(thd)
         return d
 
     def add_new_bot(self, **kwargs):
@@ -66,6 +59,7 @@ class BotDBConnectorComponent(DBConnectorComponent):
                     updated_at=kwargs.get("updated_at"),
                 )
                 conn.add(bot)
+                self.db.notify.publish(conn, "bot")
                 conn.commit()
             except Exception as err:
                 print("err:", err)
@@ -89,6 +83,7 @@ class BotDBConnectorComponent(DBConnectorComponent):
                 if val is not None:
                     setattr(bot, col, val)
                     flag_modified(bot, col)
+            self.db.notify.publish(conn, "bot", ids=[bot.id])
             conn.commit()
             return bot.to_dict()
         d = self.db.execute(thd)
@@ -99,6 +94,7 @@ class BotDBConnectorComponent(DBConnectorComponent):
             try:
                 result = conn.query(self.tbl).filter(
                     self.tbl.id == bot_id).delete()
+                self.db.notify.publish(conn, "bot", ids=[bot_id])
                 conn.commit()
             except Exception as err:
                 print("delete bot error: ", err)
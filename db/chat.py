@@ -1,6 +1,20 @@
+import functools
+import gzip
+import hashlib
+import json
+import time
+
+from sqlalchemy import and_, case, event, func, null, or_, select, tuple_, update
 from sqlalchemy.orm.attributes import flag_modified
-from db.base import DBConnectorComponent
-from db.model import Chat
+from db.base import DBConnectorComponent, NeedsOffload
+from db.cache import TTLCache
+from db.model import Chat, ChatMessage, ChatTombstone
+
+
+class ArchiveMiss(NeedsOffload):
+    '''
+    the closure needs archived blobs that are not fetched yet
+    '''
 
 
 class ChatDBConnectorComponent(DBConnectorComponent):
@@ -8,6 +22,581 @@ class ChatDBConnectorComponent(DBConnectorComponent):
     Chat component which is used to manager all Chat db interface
     '''
     tbl = Chat
+    msg_tbl = ChatMessage
+    tomb_tbl = ChatTombstone
+    SNIPPET_LEN = 100
+    TOMBSTONE_TTL = 30 * 24 * 3600
+    # seconds the last sync cursor goes back: a write picks its updated_at
+    # before it commits, possibly after the sync read
+    SYNC_MARGIN = 60
+    # search_text is capped, long pastes would only bloat the trigram index
+    SEARCH_TEXT_LEN = 10000
+    SEARCH_CONTEXT = 40
+    # a title match outranks this many matching messages
+    TITLE_WEIGHT = 5
+    # shorter queries have no trigram to look up in the index, they only
+    # scan the messages of the user's SHORT_QUERY_CHATS latest chats
+    TRIGRAM_MIN = 3
+    SHORT_QUERY_CHATS = 200
+    ARCHIVE_BATCH = 100
+    # search_text kept of an archived message, the rest only lives in the blob
+    ARCHIVE_SEARCH_LEN = 200
+    # fetch rounds of one call, a branch may need the blobs of its parents
+    ARCHIVE_FETCHES = 5
+    # parsed blobs, a key is never written twice so they do not go stale
+    ARCHIVE_CACHE_SIZE = 32
+    ARCHIVE_CACHE_TTL = 600
+    # columns batch_update can change
+    BATCH_COLUMNS = ["page_id", "title"]
+    # columns a branch takes from the chat it forks
+    FORK_COLUMNS = ["title", "model", "assistant_id", "bot_id", "artifact",
+                    "internet", "temperature"]
+
+    def __init__(self, connector):
+        super().__init__(connector)
+        self.archives = TTLCache(self.ARCHIVE_CACHE_SIZE, self.ARCHIVE_CACHE_TTL)
+
+    def _message_count(self, conn, chat_id):
+        # a branch without messages of its own has the shared ones
+        last_seq, fork_seq = conn.query(
+            func.max(self.msg_tbl.seq),
+            select(self.tbl.fork_seq).where(self.tbl.id == chat_id).scalar_subquery(),
+        ).filter(self.msg_tbl.chat_id == chat_id).one()
+        return max(0 if last_seq is None else last_seq + 1, fork_seq or 0)
+
+    def _digest(self, message):
+        return hashlib.md5(json.dumps(
+            message, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        ).encode("utf-8")).hexdigest()
+
+    def _new_message(self, chat_id, user_id, seq, message, created_at):
+        msg = message if isinstance(message, dict) else {}
+        return self.msg_tbl(
+            chat_id=chat_id,
+            user_id=user_id,
+            seq=seq,
+            role=msg.get("role"),
+            content=message,
+            digest=self._digest(message),
+            input_tokens=msg.get("input_tokens"),
+            output_tokens=msg.get("output_tokens"),
+            created_at=created_at,
+            search_text=self._text(message)[:self.SEARCH_TEXT_LEN] or None,
+        )
+
+    def _save_messages(self, conn, chat, messages, start_seq=None, created_at=None):
+        '''
+        chat: the Chat row
+        messages: the messages from start_seq on
+        start_seq: None means messages is the whole history, then only the
+            messages from the first one that differs from the stored ones
+            are written
+        '''
+        chat_id = chat.id
+        count = self._message_count(conn, chat_id)
+        if start_seq is None:
+            start_seq = self._first_change(conn, chat_id, messages, count)
+            messages = messages[start_seq:]
+        start_seq = min(start_seq, count)
+        if start_seq < count:
+            self._diverge(conn, chat_id, start_seq)
+        if start_seq < count - 1:
+            # rewriting archived messages, bring them back first
+            self._rehydrate(conn, chat_id)
+        if start_seq < count:
+            conn.query(self.msg_tbl).filter(
+                self.msg_tbl.chat_id == chat_id,
+                self.msg_tbl.seq >= start_seq).delete(synchronize_session=False)
+        conn.add_all([
+            self._new_message(chat_id, chat.user_id, seq, msg, created_at)
+            for seq, msg in enumerate(messages, start_seq)
+        ])
+        return start_seq + len(messages)
+
+    def _first_change(self, conn, chat_id, messages, count):
+        '''
+        seq of the first of messages (the whole history) that is not stored
+        as is, compared by digest
+        '''
+        end = min(count, len(messages))
+        if end == 0:
+            return 0
+        stored = self._digests(conn, chat_id, end)
+        for seq in range(end):
+            if stored.get(seq) != self._digest(messages[seq]):
+                return seq
+        return end
+
+    def _digests(self, conn, chat_id, stop):
+        '''
+        seq: digest of the stored messages before stop, messages saved
+        before the digest column existed are hashed here
+        '''
+        segments = self._segments(conn, chat_id, 0, stop)
+        if not segments:
+            return {}
+        rows = conn.query(self.msg_tbl.seq, self.msg_tbl.digest).filter(
+            self._in_segments(segments)).all()
+        digests = {seq: digest for seq, digest in rows if digest}
+        missing = [seq for seq, digest in rows if not digest]
+        if missing:
+            digests.update((seq, self._digest(content)) for seq, content in conn.query(
+                self.msg_tbl.seq, self.msg_tbl.content).filter(
+                    self._in_segments(segments), self.msg_tbl.seq.in_(missing),
+                    self.msg_tbl.content.isnot(None)).all())
+        # archived ones without a digest, or whose rows were deleted
+        keys = [key for _, lo, hi, key in segments
+                if key and any(seq not in digests for seq in range(lo, hi))]
+        self._need_archives(conn, keys)
+        for _, lo, hi, key in segments:
+            if key in keys:
+                digests.update((msg["seq"], self._digest(msg["content"]))
+                               for msg in self._archived(conn, key, lo, hi)
+                               if msg["seq"] not in digests)
+        return digests
+
+    def _segments(self, conn, chat_id, start=0, stop=None):
+        '''
+        where the messages of the chat with start <= seq < stop (None: to
+        the end) are stored, [(chat id, lo, hi, archive key)]: the chat's own
+        and, for a branch, the shared ones of its parents
+        '''
+        segments = []
+        while chat_id is not None:
+            row = conn.query(self.tbl.parent_id, self.tbl.fork_seq, self.tbl.archive).filter(
+                self.tbl.id == chat_id).first()
+            if row is None:
+                break
+            parent_id, fork_seq, key = row
+            lo = max(fork_seq or 0, start)
+            segments.append((chat_id, lo, stop, key))
+            if parent_id is None or lo <= start:
+                break
+            chat_id, stop = parent_id, lo if stop is None else min(lo, stop)
+        return segments
+
+    def _in_segments(self, segments):
+        return or_(*[
+            and_(self.msg_tbl.chat_id == seg_id, self.msg_tbl.seq >= lo,
+                 self.msg_tbl.seq < hi if hi is not None else True)
+            for seg_id, lo, hi, _ in segments])
+
+    def _archived(self, conn, key, lo, hi):
+        return [msg for msg in self._read_archive(conn, key)["messages"]
+                if msg["seq"] >= lo and (hi is None or msg["seq"] < hi)]
+
+    def _history(self, conn, chat_id, start=0, stop=None):
+        '''
+        contents of the messages of the chat with start <= seq < stop (None:
+        to the end), the shared ones of a branch are read from its parents
+        '''
+        segments = self._segments(conn, chat_id, start, stop)
+        if not segments:
+            return []
+        rows = conn.query(self.msg_tbl.chat_id, self.msg_tbl.seq, self.msg_tbl.content).filter(
+            self._in_segments(segments)).all()
+        messages = {seq: content for _, seq, content in rows}
+        keys = []
+        for seg_id, lo, hi, key in segments:
+            if not key:
+                continue
+            top = hi if hi is not None else max(
+                (seq for row_id, seq, _ in rows if row_id == seg_id), default=lo - 1) + 1
+            if any(messages.get(seq) is None for seq in range(lo, top)):
+                keys.append(key)
+        self._need_archives(conn, keys)
+        for _, lo, hi, key in segments:
+            if key in keys:
+                for msg in self._archived(conn, key, lo, hi):
+                    if messages.get(msg["seq"]) is None:
+                        messages[msg["seq"]] = msg["content"]
+        return [messages[seq] for seq in sorted(messages)]
+
+    def _diverge(self, conn, chat_id, start_seq):
+        '''
+        before the messages of the chat from start_seq on are rewritten:
+        branches sharing them get their own copy, and the chat stops sharing
+        them with its parent
+        '''
+        rows = conn.query(self.tbl).filter(or_(
+            self.tbl.id == chat_id,
+            and_(self.tbl.parent_id == chat_id, self.tbl.fork_seq > start_seq),
+        )).with_for_update().all()
+        for child in rows:
+            if child.id == chat_id:
+                continue
+            shared = self._history(conn, chat_id, start_seq, child.fork_seq)
+            self._rehydrate(conn, child.id)
+            conn.add_all([self._new_message(child.id, child.user_id, seq, msg, child.updated_at)
+                          for seq, msg in enumerate(shared, start_seq)])
+            self._fork_at(child, start_seq)
+        for chat in rows:
+            if chat.id == chat_id and chat.parent_id is not None and chat.fork_seq > start_seq:
+                self._fork_at(chat, start_seq)
+        conn.flush()
+
+    def _fork_at(self, chat, fork_seq):
+        if fork_seq > 0:
+            chat.fork_seq = fork_seq
+        else:
+            chat.parent_id = chat.fork_seq = None
+
+    def _release(self, conn, chat_ids):
+        '''
+        before the chats are deleted, copy the messages their branches share
+        with them into the branches, which then share the rest with the
+        parent of the deleted chat
+        '''
+        chat_ids = set(chat_ids)
+        while True:
+            children = conn.query(self.tbl).filter(
+                self.tbl.parent_id.in_(chat_ids), self.tbl.id.notin_(chat_ids)).all()
+            if not children:
+                return
+            for child in children:
+                parent_id, fork_seq = conn.query(self.tbl.parent_id, self.tbl.fork_seq).filter(
+                    self.tbl.id == child.parent_id).one()
+                lo = min(fork_seq, child.fork_seq) if parent_id is not None else 0
+                shared = self._history(conn, child.parent_id, lo, child.fork_seq)
+                # the copies go below the archived messages of the branch
+                self._rehydrate(conn, child.id)
+                conn.add_all([self._new_message(child.id, child.user_id, seq, msg, child.updated_at)
+                              for seq, msg in enumerate(shared, lo)])
+                child.parent_id = parent_id
+                self._fork_at(child, lo)
+            conn.flush()
+
+    def _load_contents(self, conn, chats):
+        '''
+        reassemble contents of the given chats from ChatMessage rows,
+        and from the blob store for archived chats
+        '''
+        if not chats:
+            return chats
+        messages = {chat["id"]: {} for chat in chats}
+        rows = conn.query(self.msg_tbl.chat_id, self.msg_tbl.seq, self.msg_tbl.content).filter(
+            self.msg_tbl.chat_id.in_(messages.keys())).all()
+        for chat_id, seq, content in rows:
+            messages[chat_id][seq] = content
+        if any("archive" not in chat for chat in chats):
+            # summaries leave the column out
+            keys = dict(conn.query(self.tbl.id, self.tbl.archive).filter(
+                self.tbl.id.in_(messages.keys()), self.tbl.archive.isnot(None)).all())
+        else:
+            keys = {chat["id"]: chat["archive"] for chat in chats}
+        self._need_archives(conn, keys.values())
+        for chat in chats:
+            chat.pop("archive", None)
+            own = messages[chat["id"]]
+            key = keys.get(chat["id"])
+            if key:
+                archived = self._read_archive(conn, key)
+                # the archived rows are kept without content
+                for msg in archived["messages"]:
+                    if own.get(msg["seq"]) is None:
+                        own[msg["seq"]] = msg["content"]
+                if archived["contents"] is not None:
+                    chat["contents"] = list(archived["contents"])
+            contents = [own[seq] for seq in sorted(own)]
+            # chats saved before ChatMessage existed keep their json column
+            if contents or chat.get("contents") is None:
+                chat["contents"] = contents
+            if chat.get("parent_id") is not None:
+                chat["contents"][:0] = self._history(
+                    conn, chat["parent_id"], stop=chat["fork_seq"])
+        return chats
+
+    def _need_archives(self, conn, keys):
+        '''
+        make sure the blobs of keys are fetched, or have the call fetch
+        them and run again, see _archive_call
+        '''
+        missing = {key for key in keys if key and key not in conn.info["archives"]}
+        if missing:
+            conn.info["archive_missing"].update(missing)
+            raise ArchiveMiss(f"{len(missing)} archived chats to fetch")
+
+    def _read_archive(self, conn, key):
+        self._need_archives(conn, [key])
+        archived = conn.info["archives"][key]
+        if archived is None:
+            raise LookupError(f"archived chat contents {key} not found")
+        return archived
+
+    def _fetch_archives(self, keys):
+        '''
+        get and unpack blobs, outside of the closures
+        '''
+        fetched = {}
+        for key in keys:
+            archived = self.archives.get(key)
+            if archived is None:
+                data = self.db.archive.get(key) if self.db.archive is not None else None
+                if data is not None:
+                    archived = json.loads(gzip.decompress(data))
+                    self.archives.set(key, archived)
+            fetched[key] = archived
+        return fetched
+
+    def _drop_archives(self, keys):
+        for key in keys:
+            self.archives.pop(key)
+            self.db.archive.delete(key)
+
+    def _drop_after_commit(self, conn, key):
+        event.listen(conn, "after_commit",
+                     lambda session: conn.info["archive_drop"].append(key), once=True)
+
+    def _archive_call(self, thd, readonly=False):
+        '''
+        execute thd, which may read archived chats, with the blob store IO
+        and unpacking done outside of it: when thd needs a blob not fetched
+        yet (_need_archives), its transaction is rolled back, the blobs are
+        fetched through offload and thd runs again. blobs released by its
+        commit (_drop_after_commit) are deleted the same way afterwards
+        '''
+        blobs, missing, dropped = {}, set(), []
+        @functools.wraps(thd)
+        def run(conn):
+            conn.info.update(archives=blobs, archive_missing=missing, archive_drop=dropped)
+            return thd(conn)
+        def steps():
+            res = ''
+            for _ in range(self.ARCHIVE_FETCHES):
+                missing.clear()
+                res = yield self.db.execute(run, readonly)
+                if not missing:
+                    break
+                blobs.update((yield self.db.offload(self._fetch_archives, list(missing))))
+            if dropped:
+                yield self.db.offload(self._drop_archives, list(dropped))
+            return res
+        return self.db.chain(steps())
+
+    def _rehydrate(self, conn, chat_id):
+        '''
+        move the archived messages of the chat back to ChatMessage, in the
+        caller's transaction. the blob is deleted once that commits, see
+        _archive_call
+        '''
+        chat = conn.query(self.tbl).filter(
+            self.tbl.id == chat_id).with_for_update().first()
+        if chat is None or not chat.archive:
+            return
+        key = chat.archive
+        archived = self._read_archive(conn, key)
+        # the rows kept for search, see archive_chats
+        conn.query(self.msg_tbl).filter(
+            self.msg_tbl.chat_id == chat_id,
+            self.msg_tbl.seq.in_([msg["seq"] for msg in archived["messages"]]),
+        ).delete(synchronize_session=False)
+        conn.add_all([
+            self._new_message(chat_id, chat.user_id, msg["seq"], msg["content"], msg["created_at"])
+            for msg in archived["messages"]
+        ])
+        if archived["contents"] is not None:
+            chat.contents = archived["contents"]
+        chat.archive = None
+        conn.flush()
+        self._drop_after_commit(conn, key)
+
+    def _text(self, message):
+        '''
+        plain text of a message, the text parts of multimodal contents
+        '''
+        content = message.get("content") if isinstance(message, dict) else message
+        if isinstance(content, list):
+            content = " ".join(
+                part.get("text", "") for part in content
+                if isinstance(part, dict) and part.get("text"))
+        if not isinstance(content, str):
+            return ""
+        return content
+
+    def _snippet(self, message):
+        return self._text(message)[:self.SNIPPET_LEN]
+
+    def _highlight(self, text, query):
+        '''
+        the text around the first match of query, with the [start, end)
+        offsets of every match inside the snippet
+        '''
+        if not text:
+            return "", []
+        lower, q = text.lower(), query.lower()
+        pos = lower.find(q)
+        if pos < 0:
+            return text[:self.SNIPPET_LEN], []
+        start = max(pos - self.SEARCH_CONTEXT, 0)
+        end = min(pos + len(q) + self.SEARCH_CONTEXT, len(text))
+        snippet, window = text[start:end], lower[start:end]
+        highlights, i = [], window.find(q)
+        while i >= 0:
+            highlights.append([i, i + len(q)])
+            i = window.find(q, i + len(q))
+        return snippet, highlights
+
+    def _summary_query(self, user_id):
+        return select(*self._columns("contents", "archive")).where(self.tbl.user_id == user_id)
+
+    def _summarize(self, conn, chats):
+        '''
+        add the message count and a snippet of the last message to chat
+        rows without contents
+        '''
+        if not chats:
+            return chats
+        stats = conn.query(
+            self.msg_tbl.chat_id,
+            func.max(self.msg_tbl.seq),
+        ).filter(self.msg_tbl.chat_id.in_([chat["id"] for chat in chats])).group_by(
+            self.msg_tbl.chat_id).all()
+        # seqs are dense, archived chats only keep their last message
+        counts = {chat_id: seq + 1 for chat_id, seq in stats}
+        last = conn.query(self.msg_tbl.chat_id, self.msg_tbl.content).filter(
+            tuple_(self.msg_tbl.chat_id, self.msg_tbl.seq).in_(stats)).all() if stats else []
+        snippets = {chat_id: self._snippet(content) for chat_id, content in last}
+        for chat in chats:
+            fork_seq = chat.get("fork_seq") or 0
+            chat["message_count"] = max(counts.get(chat["id"], 0), fork_seq)
+            if chat["id"] not in snippets and chat.get("parent_id") is not None:
+                # a branch without messages of its own yet
+                shared = self._history(conn, chat["parent_id"], fork_seq - 1, fork_seq)
+                snippets[chat["id"]] = self._snippet(shared[0]) if shared else ""
+            chat["snippet"] = snippets.get(chat["id"], "")
+        return chats
+
+    def get_chat_summaries(self, user_id, before=None, before_id=None, limit=50,
+                           model=None, message=None):
+        '''
+        one page of chats without contents, newest first.
+        before, before_id: keyset cursor, updated_at and id of the last chat
+            of the previous page
+        model: only chats of this model
+        message: only chats with a message containing this object,
+            e.g. {"type": 1} for chats with images, see _json_contains
+        return: (summaries, cursor of the next page or None)
+        '''
+        def thd(conn):
+            stmt = self._summary_query(user_id)
+            if model is not None:
+                stmt = stmt.where(self.tbl.model == model)
+            if message:
+                stmt = stmt.where(select(self.msg_tbl.id).where(
+                    self.msg_tbl.chat_id == self.tbl.id,
+                    self._json_contains(conn, self.msg_tbl.content, message),
+                ).exists())
+            if before is not None:
+                stmt = stmt.where(
+                    tuple_(self.tbl.updated_at, self.tbl.id) < (before, before_id)
+                    if before_id is not None else self.tbl.updated_at < before)
+            rows = self._rows(conn, stmt.order_by(
+                self.tbl.updated_at.desc(), self.tbl.id.desc()).limit(limit + 1))
+            chats = self._summarize(conn, rows[:limit])
+            cursor = None
+            if len(rows) > limit:
+                cursor = {"before": chats[-1]["updated_at"], "before_id": chats[-1]["id"]}
+            return chats, cursor
+        d = self._archive_call(thd, readonly=True)
+        return d
+
+    def get_chat_changes(self, user_id, since, since_id=None, limit=200, contents=False):
+        '''
+        chats updated and ids of chats deleted since the cursor, oldest first.
+        return: (chats, deleted chat ids, cursor of the next call), the
+            cursor is None if since is older than the kept tombstones and
+            the client has to reload everything
+        '''
+        def thd(conn):
+            now = int(time.time())
+            if since < now - self.TOMBSTONE_TTL:
+                return [], [], None
+            stmt = self._summary_query(user_id).where(
+                tuple_(self.tbl.updated_at, self.tbl.id) > (since, since_id)
+                if since_id is not None else self.tbl.updated_at >= since)
+            rows = self._rows(conn, stmt.order_by(
+                self.tbl.updated_at, self.tbl.id).limit(limit + 1))
+            chats = self._summarize(conn, rows[:limit])
+            if contents:
+                self._load_contents(conn, chats)
+            deleted = conn.query(self.tomb_tbl.chat_id).filter(
+                self.tomb_tbl.user_id == user_id,
+                self.tomb_tbl.deleted_at >= since).all()
+            if len(rows) > limit:
+                cursor = {"since": chats[-1]["updated_at"], "since_id": chats[-1]["id"]}
+            else:
+                # recent updates are sent again rather than missed
+                cursor = {"since": now - self.SYNC_MARGIN, "since_id": None}
+            return chats, [chat_id for chat_id, in deleted], cursor
+        d = self._archive_call(thd)
+        return d
+
+    def search_chats(self, user_id, query, offset=0, limit=20):
+        '''
+        chats of the user whose title or messages contain query (case
+        insensitive), best first: title matches, then the number of matching
+        messages, then the most recently updated. served by the (user_id,
+        trigram) indexes on postgres, see TRIGRAM_MIN for short queries
+        return: (results, next offset or None), a result is the chat summary
+            columns with score, the matching message seq, a snippet of it (or
+            of the title) and the highlights in the snippet
+        '''
+        def thd(conn):
+            if len(query) >= self.TRIGRAM_MIN:
+                matches = [self.msg_tbl.search_text.icontains(query, autoescape=True)]
+            else:
+                recent = select(self.tbl.id).where(self.tbl.user_id == user_id).order_by(
+                    self.tbl.updated_at.desc()).limit(self.SHORT_QUERY_CHATS)
+                # on lower(), so the planner does not scan the trigram index
+                matches = [
+                    func.lower(self.msg_tbl.search_text).contains(query.lower(), autoescape=True),
+                    self.msg_tbl.chat_id.in_(recent),
+                ]
+            hits = select(
+                self.msg_tbl.chat_id,
+                func.count().label("hits"),
+                func.max(self.msg_tbl.seq).label("seq"),
+            ).where(
+                self.msg_tbl.user_id == user_id,
+                *matches,
+            ).group_by(self.msg_tbl.chat_id).subquery()
+            title_hit = self.tbl.title.icontains(query, autoescape=True)
+            score = (case((title_hit, self.TITLE_WEIGHT), else_=0)
+                     + func.coalesce(hits.c.hits, 0))
+            stmt = select(
+                self.tbl.id, self.tbl.title, self.tbl.model, self.tbl.page_id,
+                self.tbl.created_at, self.tbl.updated_at,
+                score.label("score"), hits.c.seq,
+            ).outerjoin(hits, hits.c.chat_id == self.tbl.id).where(
+                self.tbl.user_id == user_id,
+                or_(title_hit, hits.c.chat_id.isnot(None)),
+            ).order_by(score.desc(), self.tbl.updated_at.desc(), self.tbl.id.desc()
+            ).offset(offset).limit(limit + 1)
+            results = self._rows(conn, stmt)
+            more = len(results) > limit
+            results = results[:limit]
+            matched = [(r["id"], r["seq"]) for r in results if r["seq"] is not None]
+            texts = dict(((chat_id, seq), text) for chat_id, seq, text in conn.query(
+                self.msg_tbl.chat_id, self.msg_tbl.seq, self.msg_tbl.search_text).filter(
+                    tuple_(self.msg_tbl.chat_id, self.msg_tbl.seq).in_(matched)).all()
+            ) if matched else {}
+            for r in results:
+                text = texts.get((r["id"], r["seq"])) or r["title"]
+                r["snippet"], r["highlights"] = self._highlight(text, query)
+            return results, offset + limit if more else None
+        d = self.db.read(thd)
+        return d
+
+    def export_messages(self, user_id=None, since=None, after_id=None, batch=None):
+        '''
+        stream ChatMessage rows, of one user's chats if user_id is given
+        '''
+        where = []
+        if user_id is not None:
+            where.append(self.msg_tbl.chat_id.in_(
+                select(self.tbl.id).where(self.tbl.user_id == user_id)))
+        return self.export(*where, since=since, after_id=after_id,
+                           batch=batch, tbl=self.msg_tbl)
 
     def get_chat_by_user_id(self, user_id):
         def thd(conn):
@@ -16,16 +605,25 @@ class ChatDBConnectorComponent(DBConnectorComponent):
                     self.tbl.user_id == user_id).order_by(self.tbl.updated_at.desc()).all()
             except Exception as err:
                 print(f"get chats err: {err}")
-            return [chat.to_dict() for chat in chats]
-        d = self.db.execute(thd)
+            chats = [chat.to_dict() for chat in chats]
+            return self._load_contents(conn, chats)
+        d = self._archive_call(thd, readonly=True)
         return d
 
     def get_chat_by_id(self, chat_id):
         def thd(conn):
             chat = conn.query(self.tbl).filter(
                 self.tbl.id == chat_id).first()
-            return chat.to_dict() if chat else None
-        d = self.db.execute(thd)
+            if chat is None:
+                return None
+            return self._load_contents(conn, [chat.to_dict()])[0]
+        d = self._archive_call(thd, readonly=True)
+        return d
+
+    def get_messages(self, chat_id, after_seq=-1):
+        def thd(conn):
+            return self._history(conn, chat_id, start=after_seq + 1)
+        d = self._archive_call(thd, readonly=True)
         return d
 
     def add_new_chat(self, **kwargs):
@@ -37,10 +635,10 @@ class ChatDBConnectorComponent(DBConnectorComponent):
                     user_id=kwargs.get("user_id"),
                     page_id=kwargs.get("page_id"),
                     title=kwargs.get("title", "0"),
-                    contents=kwargs.get("contents"),
                     model=kwargs.get("model"),
                     created_at=kwargs.get("created_at"),
-                    updated_at=kwargs.get("updated_at"),
+                    # never NULL, the summary and sync cursors are keyed on it
+                    updated_at=kwargs.get("updated_at") or kwargs.get("created_at") or int(time.time()),
                     assistant_id=kwargs.get("assistant_id"),
                     thread_id=kwargs.get("thread_id"),
                     bot_id=kwargs.get("bot_id"),
@@ -49,6 +647,11 @@ class ChatDBConnectorComponent(DBConnectorComponent):
                     temperature=kwargs.get("temperature"),
                 )
                 conn.add(chat)
+                conn.flush()
+                if kwargs.get("contents"):
+                    self._save_messages(conn, chat, kwargs.get("contents"), 0,
+                                        kwargs.get("created_at"))
+                self.db.notify.publish(conn, "chat", ids=[chat.id], user_id=chat.user_id)
                 conn.commit()
             except Exception as err:
                 print("add chat err: ", err)
@@ -56,10 +659,60 @@ class ChatDBConnectorComponent(DBConnectorComponent):
         d = self.db.execute(thd)
         return d
 
+    def fork_chat(self, chat_id, fork_seq, user_id=None, contents=None, **kwargs):
+        '''
+        new chat sharing the messages before fork_seq with chat_id, it only
+        stores the messages saved to it (from fork_seq on), reads put the
+        shared ones in front. saves rewriting shared messages copy them first
+        contents: the first messages of the branch, from fork_seq on
+        kwargs: columns of the new chat, FORK_COLUMNS default to the source's
+        return: id of the new chat, None if chat_id is not a chat of user_id
+        '''
+        def thd(conn):
+            src = conn.query(self.tbl).filter(self.tbl.id == chat_id).with_for_update().first()
+            if src is None or (user_id is not None and src.user_id != user_id):
+                return None
+            count = self._message_count(conn, src.id)
+            if count == 0 and (src.archive or src.contents is not None):
+                # chats saved before ChatMessage existed, move them over first
+                self._rehydrate(conn, src.id)
+                if src.contents:
+                    self._save_messages(conn, src, src.contents, 0, src.updated_at)
+                    src.contents = None
+                count = self._message_count(conn, src.id)
+            seq = min(max(fork_seq, 0), count)
+            parent = src
+            # share straight with the chat the messages are stored in
+            while parent.parent_id is not None and seq <= parent.fork_seq:
+                parent = conn.query(self.tbl).filter(
+                    self.tbl.id == parent.parent_id).with_for_update().one()
+            chat = self.tbl(
+                user_id=src.user_id,
+                page_id=kwargs.get("page_id"),
+                created_at=kwargs.get("created_at"),
+                updated_at=kwargs.get("updated_at") or kwargs.get("created_at") or int(time.time()),
+                parent_id=parent.id if seq > 0 else None,
+                fork_seq=seq if seq > 0 else None,
+                **{col: kwargs[col] if kwargs.get(col) is not None else getattr(src, col)
+                   for col in self.FORK_COLUMNS},
+            )
+            conn.add(chat)
+            conn.flush()
+            if contents:
+                self._save_messages(conn, chat, contents, seq, kwargs.get("updated_at"))
+            self.db.notify.publish(conn, "chat", ids=[chat.id], user_id=chat.user_id)
+            conn.commit()
+            return chat.id
+        d = self._archive_call(thd)
+        return d
+
     def update_chat_by_id(self, chat_id, **kwargs):
+        '''
+        contents are appended to ChatMessage, see _save_messages for start_seq
+        '''
         def thd(conn):
             update_columns = [
-                "title", "contents", "model", "created_at", "updated_at",
+                "title", "model", "created_at", "updated_at",
                 "page_id", "assistant_id", "thread_id", "bot_id", "artifact",
                 "internet", "temperature",
             ]
@@ -70,16 +723,206 @@ class ChatDBConnectorComponent(DBConnectorComponent):
                 if val is not None:
                     setattr(chat, col, val)
                     flag_modified(chat, col)
+            if kwargs.get("contents", None) is not None:
+                self._save_messages(conn, chat, kwargs.get("contents"),
+                                    kwargs.get("start_seq"), kwargs.get("updated_at"))
+            self.db.notify.publish(conn, "chat", ids=[chat.id], user_id=chat.user_id)
             conn.commit()
             return chat.id #chat.to_dict()
+        d = self._archive_call(thd)
+        return d
+
+    def append_messages(self, chat_id, messages, updated_at=None):
+        '''
+        append messages after the last stored one, return the new message count
+        '''
+        def thd(conn):
+            count = self._message_count(conn, chat_id)
+            user_id = conn.query(self.tbl.user_id).filter(self.tbl.id == chat_id).scalar()
+            conn.add_all([
+                self._new_message(chat_id, user_id, seq, msg, updated_at)
+                for seq, msg in enumerate(messages, count)
+            ])
+            if updated_at is not None:
+                conn.query(self.tbl).filter(self.tbl.id == chat_id).update(
+                    {self.tbl.updated_at: updated_at}, synchronize_session=False)
+            self.db.notify.publish(conn, "chat", ids=[chat_id])
+            conn.commit()
+            return count + len(messages)
         d = self.db.execute(thd)
         return d
 
     def delete_chat(self, chat_id):
         def thd(conn):
+            user_id, key = conn.query(self.tbl.user_id, self.tbl.archive).filter(
+                self.tbl.id == chat_id).first() or (None, None)
+            self._release(conn, [chat_id])
+            conn.query(self.msg_tbl).filter(
+                self.msg_tbl.chat_id == chat_id).delete(synchronize_session=False)
             result = conn.query(self.tbl).filter(
                 self.tbl.id == chat_id).delete()
+            if user_id is not None:
+                self._tombstone(conn, user_id, [chat_id], int(time.time()))
+            if key:
+                self._drop_after_commit(conn, key)
+            self.db.notify.publish(conn, "chat", ids=[chat_id], user_id=user_id)
             conn.commit()
             return result
-        d = self.db.execute(thd)
+        d = self._archive_call(thd)
         return d
+
+    def _tombstone(self, conn, user_id, chat_ids, now):
+        conn.add_all([self.tomb_tbl(chat_id=chat_id, user_id=user_id, deleted_at=now)
+                      for chat_id in chat_ids])
+        conn.query(self.tomb_tbl).filter(
+            self.tomb_tbl.user_id == user_id,
+            self.tomb_tbl.deleted_at < now - self.TOMBSTONE_TTL,
+        ).delete(synchronize_session=False)
+
+    def batch_update(self, user_id, delete=(), changes=None, updated_at=None):
+        '''
+        delete and update many chats of the user in one transaction, with
+        one statement each, and bump User.updated_at once.
+        chats of other users are ignored
+        delete: chat ids
+        changes: dict, key: chat id, value: dict of BATCH_COLUMNS values
+        return: {"deleted": n, "updated": n, "updated_at": updated_at}
+        '''
+        updated_at = updated_at or int(time.time())
+        delete = set(delete)
+        changes = {chat_id: values for chat_id, values in (changes or {}).items()
+                   if chat_id not in delete}
+        def thd(conn):
+            deleted = updated = 0
+            if delete:
+                rows = conn.query(self.tbl.id, self.tbl.archive).filter(
+                    self.tbl.id.in_(delete), self.tbl.user_id == user_id).all()
+                owned = [chat_id for chat_id, _ in rows]
+                for _, key in rows:
+                    if key:
+                        self._drop_after_commit(conn, key)
+                if owned:
+                    self._release(conn, owned)
+                    conn.query(self.msg_tbl).filter(
+                        self.msg_tbl.chat_id.in_(owned)).delete(synchronize_session=False)
+                    deleted = conn.query(self.tbl).filter(
+                        self.tbl.id.in_(owned)).delete(synchronize_session=False)
+                    self._tombstone(conn, user_id, owned, updated_at)
+            values = {}
+            for col in self.BATCH_COLUMNS:
+                whens = {chat_id: v[col] for chat_id, v in changes.items()
+                         if v.get(col) is not None}
+                if whens:
+                    values[col] = case(whens, value=self.tbl.id, else_=getattr(self.tbl, col))
+            if values:
+                values["updated_at"] = updated_at
+                updated = conn.execute(update(self.tbl).where(
+                    self.tbl.id.in_(changes), self.tbl.user_id == user_id,
+                ).values(values).execution_options(synchronize_session=False)).rowcount
+            if deleted or updated:
+                self.db.user.touch_in(conn, user_id, updated_at)
+                self.db.notify.publish(conn, "chat", ids=sorted(delete | set(changes)),
+                                       user_id=user_id)
+            conn.commit()
+            self.db.user.invalidate([user_id])
+            return {"deleted": deleted, "updated": updated, "updated_at": updated_at}
+        d = self._archive_call(thd)
+        return d
+
+    def archive_chats(self, before, limit=None):
+        '''
+        move the contents of chats not updated since before to the blob
+        store, one batch per call. the last message stays, so summaries and
+        appends work as before, the rest is read back from the blob
+        transparently and moved back when it is rewritten.
+        the archived messages keep a small row each: no content, the digest
+        and the first ARCHIVE_SEARCH_LEN characters of search_text, so the
+        table stays small and archived chats stay searchable, but only on
+        the start of each message. export_messages has them with content
+        null, a rewrite brings the full rows back.
+        the blobs are written between two transactions, a chat changed in
+        the meantime is left for the next run
+        return: the number of chats archived, 0 when there are none left
+        '''
+        if self.db.archive is None:
+            return self.db.result(0)
+        def select_chats(conn):
+            movable = select(self.msg_tbl.id).where(
+                self.msg_tbl.chat_id == self.tbl.id,
+                self.msg_tbl.seq > func.coalesce(self.tbl.fork_seq, 0)).exists()
+            chats = conn.query(self.tbl).filter(
+                self.tbl.updated_at < before,
+                self.tbl.archive.is_(None),
+                or_(movable, self.tbl.contents.isnot(None)),
+            ).order_by(self.tbl.updated_at).limit(limit or self.ARCHIVE_BATCH).all()
+            payloads = {}
+            for chat in chats:
+                rows = conn.query(self.msg_tbl).filter(
+                    self.msg_tbl.chat_id == chat.id).order_by(self.msg_tbl.seq).all()
+                payloads[chat.id] = {
+                    "key": f"chats/{chat.user_id}/{chat.id}-{int(time.time())}.json.gz",
+                    "rows": [msg.id for msg in rows],
+                    "archive": {
+                        "chat_id": chat.id,
+                        # the legacy json column, only read when there are no messages
+                        "contents": None if rows else chat.contents,
+                        "messages": [{"seq": msg.seq, "content": msg.content,
+                                      "created_at": msg.created_at} for msg in rows[:-1]],
+                    },
+                }
+            return payloads
+        def pack(payloads):
+            stored = {}
+            for chat_id, payload in payloads.items():
+                try:
+                    self.db.archive.put(payload["key"], gzip.compress(
+                        json.dumps(payload["archive"]).encode("utf-8")))
+                except Exception as err:
+                    print(f"archive chat {chat_id} err: {err}")
+                    continue
+                stored[chat_id] = payload
+            return stored
+        def steps():
+            # on the primary, the rows are checked against it below
+            payloads = yield self.db.execute(select_chats)
+            if not payloads:
+                return 0
+            stored = yield self.db.offload(pack, payloads)
+            if not stored:
+                return 0
+            def thd(conn):
+                chats = conn.query(self.tbl).filter(
+                    self.tbl.id.in_(stored), self.tbl.archive.is_(None),
+                ).with_for_update(skip_locked=True).all()
+                archived = []
+                for chat in chats:
+                    payload = stored[chat.id]
+                    if chat.updated_at >= before:
+                        continue
+                    rows = conn.query(self.msg_tbl.id, self.msg_tbl.seq).filter(
+                        self.msg_tbl.chat_id == chat.id).order_by(self.msg_tbl.seq).all()
+                    if [row_id for row_id, _ in rows] != payload["rows"]:
+                        # changed since the blob was written
+                        continue
+                    if len(rows) > 1:
+                        conn.query(self.msg_tbl).filter(
+                            self.msg_tbl.chat_id == chat.id,
+                            self.msg_tbl.seq < rows[-1].seq,
+                        ).update({
+                            self.msg_tbl.content: null(),
+                            self.msg_tbl.search_text: func.substr(
+                                self.msg_tbl.search_text, 1, self.ARCHIVE_SEARCH_LEN),
+                        }, synchronize_session=False)
+                    conn.execute(update(self.tbl).where(self.tbl.id == chat.id).values(
+                        archive=payload["key"], contents=null()))
+                    archived.append(chat.id)
+                conn.commit()
+                return archived
+            archived = yield self.db.execute(thd)
+            archived = archived if isinstance(archived, list) else []
+            stale = [payload["key"] for chat_id, payload in stored.items()
+                     if chat_id not in archived]
+            if stale:
+                yield self.db.offload(self._drop_archives, stale)
+            return len(archived)
+        return self.db.chain(steps())
@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
+import asyncio
 import concurrent.futures
 import logging as log
+import time
 
-from contextlib import contextmanager
-from sqlalchemy import create_engine
+from contextlib import contextmanager, asynccontextmanager
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from db.user import UserDBConnectorComponent
 from db.chat import ChatDBConnectorComponent
@@ -13,6 +18,13 @@ from db.bot import BotDBConnectorComponent
 from db.shares import SharesDBConnectorComponent
 from db.mcp import MCPDBConnectorComponent
 from db.order import OrderDBConnectorComponent
+from db.usage import UsageDBConnectorComponent
+from db.base import NeedsOffload
+from db.model import Base, Shares
+from db.notify import create_bus
+from db.metrics import Metrics
+from db.replica import (Replica, ReplicaLagging, RecentWrites, current_user, on_primary,
+                        pin, pinned)
 
 
 @contextmanager
@@ -28,24 +40,93 @@ def session_scope(Session=None):
         session.close()
 
 
+@asynccontextmanager
+async def async_session_scope(Session=None):
+    session = Session()
+    try:
+        yield session
+        await session.commit()
+    except Exception as exce:
+        await session.rollback()
+        raise Exception from exce
+    finally:
+        await session.close()
+
+
+def is_sqlite(db_url):
+    return make_url(db_url).get_backend_name() == "sqlite"
+
+
+def sqlite_engine_args(db_url):
+    '''
+    SQLite objects created in a thread can only be used in that same thread,
+    an in memory database lives in its connection, so there is only one
+    '''
+    args = {"connect_args": {"check_same_thread": False}}
+    if make_url(db_url).database in (None, "", ":memory:"):
+        args["poolclass"] = StaticPool
+    return args
+
+
+def sqlite_pragmas(dbapi_conn, record):
+    cursor = dbapi_conn.cursor()
+    # readers do not block the writer, wait for the write lock instead of failing
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def create_tables(conn):
+    '''
+    create the schema from the models and the Shares row, for SQLite local
+    mode and benchmarks, postgres is migrated with alembic
+    '''
+    Base.metadata.create_all(conn)
+    if conn.execute(select(Shares.id).limit(1)).first() is None:
+        now = int(time.time())
+        conn.execute(insert(Shares).values(bot_updated=now, mcp_updated=now))
+
+
 class DBClient():
     '''
     Used to operate the database.
     We'd prefer high level api to set mysql driver to make our internace common
     Input: dburl : dburl = "mysql+{driver}://{user}:{pwd}@{server}:{port}/{db}?charset=utf8mb4"
+           sqlite:///{path} or sqlite:// (in memory), see DBClient.sqlite
+           replica_urls: read replicas, execute(f, readonly=True) reads from
+           them while their lag is below REPLICA_MAX_LAG
+    every execute is timed per component method in self.metrics
     '''
     POOL_SIZE = 10
     TAG = 'DBTreadPool'
+    REPLICA_MAX_LAG = 5
+    REPLICA_CHECK_INTERVAL = 2
+    REPLICA_RETRY = 30
+    # calls slower than this are logged, 0 disables the log
+    SLOW_QUERY_MS = 500
+    SQLITE_DRIVER = "sqlite"
 
-    def __init__(self, db_url=None, connect_args=None):
+    on_primary = staticmethod(on_primary)
+
+    def __init__(self, db_url=None, connect_args=None, replica_urls=None):
         self.db_url = db_url
         self.engine = None
         self.scoped_session = None
-        # pylint: disable = consider-using-with
-        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.POOL_SIZE,
-                                                          thread_name_prefix=self.TAG)
+        self.pool = None
 
+        self._init_pool()
         self._init_session(connect_args)
+        self.replicas = [
+            Replica(url, *self._create_session(url, connect_args))
+            for url in replica_urls or []
+        ]
+        self._next_replica = 0
+        self.recent_writes = RecentWrites()
+        self.notify = create_bus(db_url)
+        self.metrics = Metrics(self.SLOW_QUERY_MS)
+        # blob store of archived chat messages, see ChatDBConnectorComponent.archive_chats
+        self.archive = None
 
         self.user = UserDBConnectorComponent(self)
         self.chat = ChatDBConnectorComponent(self)
@@ -53,27 +134,253 @@ class DBClient():
         self.shares = SharesDBConnectorComponent(self)
         self.mcp = MCPDBConnectorComponent(self)
         self.order = OrderDBConnectorComponent(self)
+        self.usage = UsageDBConnectorComponent(self)
+        self.metrics.gauges.update(self._gauges())
 
-    def _init_session(self, connect_args):
-        if connect_args:
-            # SQLite objects created in a thread can only be used in that same thread
-            self.engine = create_engine(self.db_url, pool_pre_ping=True, connect_args={'check_same_thread': False})
+    @classmethod
+    def sqlite(cls, path=":memory:", **kwargs):
+        '''
+        client of a SQLite file, call create_all() before use
+        '''
+        return cls(f"{cls.SQLITE_DRIVER}:///{path}", **kwargs)
+
+    def _init_pool(self):
+        # pylint: disable = consider-using-with
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.POOL_SIZE,
+                                                          thread_name_prefix=self.TAG)
+
+    def _create_session(self, db_url, connect_args):
+        if connect_args or is_sqlite(db_url):
+            engine = create_engine(db_url, pool_pre_ping=True, **sqlite_engine_args(db_url))
+            event.listen(engine, "connect", sqlite_pragmas)
         else:
-            self.engine = create_engine(self.db_url, pool_pre_ping=True)
-        self.Session = sessionmaker(bind=self.engine)
+            engine = create_engine(db_url, pool_pre_ping=True)
+        return engine, sessionmaker(bind=engine)
+
+    def _gauges(self):
+        gauges = {
+            # not every pool counts (StaticPool, NullPool), the render skips it then
+            "db_pool_checked_out": lambda: self.engine.pool.checkedout(),
+            "db_user_cache_size": lambda: len(self.user.cache.data),
+            "db_user_cache_hits": lambda: self.user.cache.hits,
+            "db_user_cache_misses": lambda: self.user.cache.misses,
+        }
+        if self.pool is not None:
+            # closures waiting for a worker thread
+            gauges["db_thread_queue_depth"] = self.pool._work_queue.qsize
+        return gauges
+
+    def _init_session(self, connect_args):
+        self.engine, self.Session = self._create_session(self.db_url, connect_args)
+
+    def _replica(self, readonly):
+        '''
+        next usable replica for a read, None to read from the primary
+        '''
+        if not readonly or not self.replicas or pinned():
+            return None
+        if self.recent_writes.pinned(current_user()):
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next_replica % len(self.replicas)]
+            self._next_replica += 1
+            if replica.usable(self.REPLICA_MAX_LAG, self.REPLICA_CHECK_INTERVAL,
+                              self.REPLICA_RETRY):
+                return replica
+        return None
 
-    def execute(self, f):
+    def _replica_failed(self, replica, f, exce):
+        if not isinstance(exce.__cause__, (ReplicaLagging, NeedsOffload)):
+            replica.fail()
+            log.error('db.replica {} cmd {} generated an exception: {}'.format(
+                replica.engine.url.host, f, exce.__cause__ or exce))
+
+    def _run(self, Session, f, cmd=None, target="primary"):
+        '''
+        cmd: the component closure when f wraps it, for the metrics
+        '''
+        timer = self.metrics.timer(cmd or f, target)
+        try:
+            with session_scope(Session) as session:
+                futuer = self.pool.submit(timer.wrap(f), session)
+                return futuer.result()
+        except Exception as exce:
+            if not isinstance(exce.__cause__, NeedsOffload):
+                timer.error()
+            raise
+        finally:
+            timer.done()
+
+    def execute(self, f, readonly=False):
+        '''
+        readonly: f only reads and may be served by a replica, writes pin
+            the reads of the current context, and of the user it acts for
+            (db.replica.as_user) in later requests, to the primary for a while
+        '''
+        replica = self._replica(readonly)
+        if replica is not None:
+            try:
+                return self._run(replica.Session, replica.guard(
+                    f, self.REPLICA_MAX_LAG, self.REPLICA_CHECK_INTERVAL), f, "replica")
+            except Exception as exce:
+                if isinstance(exce.__cause__, NeedsOffload):
+                    return ''
+                self._replica_failed(replica, f, exce)
         data = ''
         try:
-            with session_scope(self.Session) as session:
-                futuer = self.pool.submit(f, session)
-                data = futuer.result()
+            data = self._run(self.Session, f)
         except Exception as exce:
-            log.error('db.pool cmd {} generated an exception: {}'.format(
-                f, exce))
+            if not isinstance(exce.__cause__, NeedsOffload):
+                log.error('db.pool cmd {} generated an exception: {}'.format(
+                    f, exce.__cause__ or exce))
+        if not readonly and self.replicas:
+            pin(self.REPLICA_MAX_LAG)
+            self.recent_writes.add(current_user(), self.REPLICA_MAX_LAG)
 
         return data
 
+    def read(self, f):
+        return self.execute(f, readonly=True)
+
+    def result(self, data):
+        '''
+        return data the same way execute does, for components answering
+        without the database (e.g. from a cache)
+        '''
+        return data
+
+    def offload(self, f, *args):
+        '''
+        f(*args) for blocking work that is not a query (blob store calls,
+        compression), kept out of the component closures. returned the same
+        way execute returns
+        '''
+        return f(*args)
+
+    def chain(self, steps):
+        '''
+        run a component method made of several calls: steps is a generator
+        that yields what execute, read or offload returned and is sent the
+        result. return: its return value, the same way execute returns
+        '''
+        result = None
+        while True:
+            try:
+                result = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+
+    def stream(self, stmt, batch=1000):
+        '''
+        yield the rows of stmt as lists of up to batch row mappings,
+        fetched through a server side cursor, from a replica if there is one
+        '''
+        replica = self._replica(True)
+        Session = replica.Session if replica is not None else self.Session
+        with session_scope(Session) as session:
+            result = session.execute(stmt.execution_options(yield_per=batch))
+            for rows in result.mappings().partitions():
+                yield rows
+
+    def create_all(self):
+        with self.engine.begin() as conn:
+            create_tables(conn)
+
     def close_connect(self):
         self.pool.shutdown()
         self.engine.dispose()
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+class AsyncDBClient(DBClient):
+    '''
+    Same components as DBClient, but every component method returns an awaitable.
+    The component closures run through AsyncSession.run_sync, so a query only
+    suspends the calling coroutine instead of blocking the event loop.
+    Input: dburl : dburl = "postgresql+asyncpg://{user}:{pwd}@{server}:{port}/{db}"
+                   or "sqlite+aiosqlite:///{path}"
+    '''
+    SQLITE_DRIVER = "sqlite+aiosqlite"
+
+    def _init_pool(self):
+        # no worker threads, the driver itself is non-blocking
+        self.pool = None
+
+    def _create_session(self, db_url, connect_args):
+        if connect_args or is_sqlite(db_url):
+            engine = create_async_engine(db_url, pool_pre_ping=True, **sqlite_engine_args(db_url))
+            event.listen(engine.sync_engine, "connect", sqlite_pragmas)
+        else:
+            engine = create_async_engine(db_url, pool_pre_ping=True)
+        # rows are returned as dicts right after commit, reloading them is a wasted round trip
+        return engine, async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def _run(self, Session, f, cmd=None, target="primary"):
+        timer = self.metrics.timer(cmd or f, target)
+        try:
+            async with async_session_scope(Session) as session:
+                return await session.run_sync(timer.wrap(f))
+        except Exception as exce:
+            if not isinstance(exce.__cause__, NeedsOffload):
+                timer.error()
+            raise
+        finally:
+            timer.done()
+
+    async def execute(self, f, readonly=False):
+        replica = self._replica(readonly)
+        if replica is not None:
+            try:
+                return await self._run(replica.Session, replica.guard(
+                    f, self.REPLICA_MAX_LAG, self.REPLICA_CHECK_INTERVAL), f, "replica")
+            except Exception as exce:
+                if isinstance(exce.__cause__, NeedsOffload):
+                    return ''
+                self._replica_failed(replica, f, exce)
+        data = ''
+        try:
+            data = await self._run(self.Session, f)
+        except Exception as exce:
+            if not isinstance(exce.__cause__, NeedsOffload):
+                log.error('db.async cmd {} generated an exception: {}'.format(
+                    f, exce.__cause__ or exce))
+        if not readonly and self.replicas:
+            pin(self.REPLICA_MAX_LAG)
+            self.recent_writes.add(current_user(), self.REPLICA_MAX_LAG)
+
+        return data
+
+    async def result(self, data):
+        return data
+
+    async def offload(self, f, *args):
+        # on a worker thread, the closures run on the event loop
+        return await asyncio.to_thread(f, *args)
+
+    async def chain(self, steps):
+        result = None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = await step
+
+    async def stream(self, stmt, batch=1000):
+        replica = self._replica(True)
+        Session = replica.Session if replica is not None else self.Session
+        async with async_session_scope(Session) as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch))
+            async for rows in result.mappings().partitions():
+                yield rows
+
+    async def create_all(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(create_tables)
+
+    async def close_connect(self):
+        await self.notify.close()
+        await self.engine.dispose()
+        for replica in self.replicas:
+            await replica.engine.dispose()
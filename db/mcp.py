@@ -1,3 +1,4 @@
+from sqlalchemy import or_, select, tuple_
 from sqlalchemy.orm.attributes import flag_modified
 from db.base import DBConnectorComponent
 from db.model import McpServer
@@ -11,31 +12,48 @@ class MCPDBConnectorComponent(DBConnectorComponent):
 
     def get_all_mcps(self):
         def thd(conn):
-            try:
-                mcps = conn.query(self.tbl).order_by(self.tbl.created_at).all()
-            except Exception as err:
-                print(f"get all mcps err: {err}")
-            return [mcp.to_dict() for mcp in mcps]
+            return self._rows(conn, select(*self._columns()).order_by(self.tbl.created_at))
         d = self.db.execute(thd)
         return d
 
-    def get_mcp_by_owner_id(self, owner_id):
+    def get_visible_mcps(self, user_id, after=None, after_id=None, limit=100):
+        '''
+        one page of the servers the user owns or that are public, oldest first.
+        after, after_id: keyset cursor, created_at and id of the last server
+            of the previous page
+        return: (mcps, cursor of the next page or None)
+        '''
         def thd(conn):
-            try:
-                mcps = conn.query(self.tbl).filter(
-                    self.tbl.owner_id == owner_id).all()
-            except Exception as err:
-                print(f"get mcp err: {err}")
-            return [mcp.to_dict() for mcp in mcps]
+            # == True keeps the planner on the partial index over is_public
+            stmt = select(*self._columns()).where(or_(
+                self.tbl.owner_id == user_id, self.tbl.is_public == True))
+            if after is not None:
+                stmt = stmt.where(
+                    tuple_(self.tbl.created_at, self.tbl.id) > (after, after_id)
+                    if after_id is not None else self.tbl.created_at > after)
+            rows = self._rows(conn, stmt.order_by(
+                self.tbl.created_at, self.tbl.id).limit(limit + 1))
+            mcps = rows[:limit]
+            cursor = None
+            if len(rows) > limit:
+                cursor = {"after": mcps[-1]["created_at"], "after_id": mcps[-1]["id"]}
+            return mcps, cursor
         d = self.db.execute(thd)
         return d
 
+    def get_mcp_by_owner_id(self, owner_id):
+        def thd(conn):
+            return self._rows(conn, select(*self._columns()).where(
+                self.tbl.owner_id == owner_id))
+        d = self.db.read(thd)
+        return d
+
     def get_mcp_by_id(self, mcp_id):
         def thd(conn):
             mcp = conn.query(self.tbl).filter(
                 self.tbl.id == mcp_id).first()
             return mcp.to_dict() if mcp else None
-        d = self.db.execute(thd)
+        d = self.db.read(thd)
         return d
 
     def add_new_mcp(self, **kwargs):
@@ -59,6 +77,7 @@ class MCPDBConnectorComponent(DBConnectorComponent):
                     updated_at=kwargs.get("updated_at"),
                 )
                 conn.add(mcp)
+                self.db.notify.publish(conn, "mcp", ids=[mcp.id])
                 conn.commit()
             except Exception as err:
                 print("err:", err)
@@ -81,6 +100,7 @@ class MCPDBConnectorComponent(DBConnectorComponent):
                     if val is not None:
                         setattr(mcp, col, val)
                         flag_modified(mcp, col)
+                self.db.notify.publish(conn, "mcp", ids=[mcp.id])
                 conn.commit()
             except Exception as e:
                 print("terr: ", e)
@@ -93,6 +113,7 @@ class MCPDBConnectorComponent(DBConnectorComponent):
             try:
                 result = conn.query(self.tbl).filter(
                     self.tbl.id == mcp_id).delete()
+                self.db.notify.publish(conn, "mcp", ids=[mcp_id])
                 conn.commit()
             except Exception as err:
                 print("delete mcp error: ", err)
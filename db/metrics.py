@@ -0,0 +1,178 @@
+import inspect
+import logging as log
+import threading
+import time
+
+# seconds, the prometheus client defaults
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def method_name(f):
+    '''
+    "user.get_user_by_id" from the qualname of a component closure,
+    UserDBConnectorComponent.get_user_by_id.<locals>.thd
+    '''
+    parts = getattr(f, "__qualname__", repr(f)).split(".")
+    if len(parts) < 2:
+        return parts[0]
+    component = parts[0].replace("DBConnectorComponent", "").lower() or parts[0]
+    return f"{component}.{parts[1]}"
+
+
+def describe(value):
+    '''
+    the value for the log without its content, which may be a password
+    hash, an email or chat messages: numbers as they are, the shape of the
+    rest, dict keys but not their values
+    '''
+    if value is None or isinstance(value, (bool, int, float)):
+        return repr(value)
+    if isinstance(value, dict):
+        return "dict(" + ",".join(str(key) for key in list(value)[:10]) + ")"
+    if isinstance(value, (list, tuple, set, str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def closure_args(f):
+    '''
+    the arguments a component closure captured, for the slow query log
+    '''
+    f = inspect.unwrap(f)
+    cells = getattr(f, "__closure__", None) or ()
+    args = {}
+    for name, cell in zip(f.__code__.co_freevars, cells):
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        if name == "self" or callable(value):
+            continue
+        args[name] = describe(value)
+    return args
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timer:
+    '''
+    one component call, wrap() the closure to also time the pool checkout
+    '''
+
+    def __init__(self, metrics, f, target="primary"):
+        self.metrics = metrics
+        self.f = f
+        self.key = (method_name(f), target)
+        self.start = time.perf_counter()
+        self.queue_wait = 0.0
+        self.pool_wait = 0.0
+        self.failed = False
+        metrics.enter()
+
+    def wrap(self, f):
+        def thd(session):
+            started = time.perf_counter()
+            # check the connection out now, so the wait is not in the query time
+            session.connection()
+            self.queue_wait = started - self.start
+            self.pool_wait = time.perf_counter() - started
+            return f(session)
+        return thd
+
+    def error(self):
+        self.failed = True
+
+    def done(self):
+        self.metrics.record(self, time.perf_counter() - self.start)
+
+
+class Metrics:
+    '''
+    per component method latency, pool wait and error counts of a DBClient,
+    rendered in the prometheus text format
+    slow_ms: calls slower than this are logged with their arguments
+    '''
+
+    def __init__(self, slow_ms=500):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.pool_wait = {}
+        self.queue_wait = {}
+        self.errors = {}
+        self.inflight = 0
+        # name: callable returning a number, sampled on render
+        self.gauges = {}
+
+    def timer(self, f, target="primary"):
+        '''
+        f: the component closure, it names the method
+        '''
+        return Timer(self, f, target)
+
+    def enter(self):
+        with self.lock:
+            self.inflight += 1
+
+    def record(self, timer, elapsed):
+        key = timer.key
+        with self.lock:
+            self.inflight -= 1
+            self.latency.setdefault(key, Histogram()).observe(elapsed)
+            self.pool_wait.setdefault(key, Histogram()).observe(timer.pool_wait)
+            self.queue_wait.setdefault(key, Histogram()).observe(timer.queue_wait)
+            if timer.failed:
+                self.errors[key] = self.errors.get(key, 0) + 1
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            log.warning("slow db call {} on {}: {:.0f}ms (pool wait {:.0f}ms) args {}".format(
+                key[0], key[1], elapsed * 1000, timer.pool_wait * 1000,
+                closure_args(timer.f)))
+
+    def _histogram(self, lines, name, help, data):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for (method, target), hist in sorted(data.items()):
+            labels = f'method="{method}",target="{target}"'
+            total = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), hist.counts):
+                total += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+    def render(self):
+        lines = []
+        with self.lock:
+            self._histogram(lines, "db_call_seconds",
+                            "component method latency", self.latency)
+            self._histogram(lines, "db_pool_wait_seconds",
+                            "time to check out a connection", self.pool_wait)
+            self._histogram(lines, "db_queue_wait_seconds",
+                            "time before the closure started running", self.queue_wait)
+            lines.append("# HELP db_call_errors_total component calls that raised")
+            lines.append("# TYPE db_call_errors_total counter")
+            for (method, target), count in sorted(self.errors.items()):
+                lines.append(f'db_call_errors_total{{method="{method}",target="{target}"}} {count}')
+            lines.append("# TYPE db_inflight gauge")
+            lines.append(f"db_inflight {self.inflight}")
+        for name, sample in self.gauges.items():
+            try:
+                value = sample()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
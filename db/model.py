@@ -3,13 +3,18 @@ import time
 
 from dictns import Namespace
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, JSON, Boolean, Text
+from sqlalchemy import Column, String, Integer, BigInteger, Float, ForeignKey, JSON, Boolean, Text, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 from typing import Optional, Dict
 import uuid
 
 Base = declarative_base()
 
+# binary jsonb on postgres: parsed once on write and indexable (GIN),
+# see DBConnectorComponent._json_contains
+JSONDoc = JSON().with_variant(JSONB(), "postgresql")
+
 
 def to_dict(self):
     return Namespace({c.name: getattr(self, c.name, None) for c in self.__table__.columns})
@@ -35,7 +40,11 @@ class User(Base):
     updated_at = Column(Integer(), default=None)
     credit = Column(Float(), comment="credit balance", default=0.0)
     active = Column(Boolean(), comment="whether the user is active", default=True)
-    settings = Column(JSON(), comment="user settings")
+    settings = Column(JSONDoc, comment="user settings")
+
+    __table_args__ = (
+        Index("ix_user_email", "email"),
+    )
 
 
 class Chat(Base):
@@ -47,7 +56,7 @@ class Chat(Base):
     page_id = Column(Integer(), comment="tab id assigned in user level", default=-1)
     user_id = Column(Integer(), ForeignKey(User.id), nullable=False)
     title = Column(String(50), comment="this chat title")
-    contents = Column(JSON(), comment="chat content of this title")
+    contents = Column(JSONDoc, comment="chat content of this title")
     model = Column(String(50), comment="chat model")
     created_at = Column(Integer(), default=None)
     updated_at = Column(Integer(), default=None)
@@ -57,6 +66,61 @@ class Chat(Base):
     artifact = Column(Boolean(), comment="enable artifact", default=False)
     internet = Column(Boolean(), comment="enable internet", default=False)
     temperature = Column(Float(), comment="model temperature", default=None)
+    archive = Column(String(), comment="blob key of the archived messages", default=None)
+    parent_id = Column(Integer(), ForeignKey("Chat.id"), comment="chat this one branches off", default=None)
+    fork_seq = Column(Integer(), comment="messages before this seq are the parent's", default=None)
+
+    __table_args__ = (
+        Index("ix_chat_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_chat_parent_id", "parent_id"),
+        # substring search within a user's chats (btree_gin for user_id),
+        # see ChatDBConnectorComponent.search_chats
+        Index("ix_chat_user_id_title_trgm", "user_id", "title", postgresql_using="gin",
+              postgresql_ops={"title": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+class ChatMessage(Base):
+    '''
+    chat message table, one row per message so saving a turn only appends
+    '''
+    __tablename__ = 'ChatMessage'
+    id = Column(Integer(), primary_key=True, index=True)
+    chat_id = Column(Integer(), ForeignKey(Chat.id, ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer(), comment="Chat.user_id, so search is indexed per user", default=None)
+    seq = Column(Integer(), comment="position of the message in the chat", nullable=False)
+    role = Column(String(20), comment="message role")
+    content = Column(JSONDoc, comment="the message as sent by the client")
+    input_tokens = Column(Integer(), default=None)
+    output_tokens = Column(Integer(), default=None)
+    created_at = Column(Integer(), default=None)
+    search_text = Column(Text(), comment="plain text of the message for search", default=None)
+    digest = Column(String(32), comment="md5 of the message json, to find what a save changed", default=None)
+
+    __table_args__ = (
+        UniqueConstraint("chat_id", "seq", name="uq_chat_message_chat_id_seq"),
+        Index("ix_chat_message_user_id_search_text_trgm", "user_id", "search_text",
+              postgresql_using="gin",
+              postgresql_ops={"search_text": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        # content @> {...} lookups
+        Index("ix_chat_message_content_gin", "content", postgresql_using="gin",
+              postgresql_ops={"content": "jsonb_path_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+class ChatTombstone(Base):
+    '''
+    deleted chats, kept for a while so clients can sync deletions
+    '''
+    __tablename__ = 'ChatTombstone'
+    id = Column(Integer(), primary_key=True, index=True)
+    chat_id = Column(Integer(), comment="id of the deleted chat", nullable=False)
+    user_id = Column(Integer(), nullable=False)
+    deleted_at = Column(Integer(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_chat_tombstone_user_id_deleted_at", "user_id", "deleted_at"),
+    )
 
 
 class Bot(Base):
@@ -72,10 +136,10 @@ class Bot(Base):
     instructions = Column(String, comment="bot instructions", nullable=False)
     model = Column(String, comment="the default model to use")
     file_search = Column(Boolean(), comment="enable file search or not", default=False)
-    vector_store_ids = Column(JSON(), comment="file search file_ids, dict, key: id, val: name}")
+    vector_store_ids = Column(JSONDoc, comment="file search file_ids, dict, key: id, val: name}")
     code_interpreter = Column(Boolean(), comment="enable code interpreter or not", default=False)
-    code_interpreter_files = Column(JSON(), comment="dict, key: filename, value: file-id")
-    functions = Column(JSON(), comment="dict, key: name, value: function body")
+    code_interpreter_files = Column(JSONDoc, comment="dict, key: filename, value: file-id")
+    functions = Column(JSONDoc, comment="dict, key: name, value: function body")
     temperature = Column(Float(), comment="sampling temperature, between 0 and 2", default=1.0)
     author_id = Column(Integer(), comment="author id")
     author_name = Column(String(50), comment="author name")
@@ -84,6 +148,10 @@ class Bot(Base):
     created_at = Column(Integer(), default=None)
     updated_at = Column(Integer(), default=None)
 
+    __table_args__ = (
+        Index("ix_bot_author_id", "author_id"),
+    )
+
 
 class McpServer(Base):
     __tablename__ = 'mcp'
@@ -91,7 +159,7 @@ class McpServer(Base):
     name = Column(String, nullable=False)
     command = Column(String, nullable=False)
     args = Column(String, nullable=False)
-    custom_environment = Column(JSON, default=dict)
+    custom_environment = Column(JSONDoc, default=dict)
     owner_id = Column(Integer, nullable=False)
     owner_name = Column(String, nullable=False)
     is_public = Column(Boolean, default=False)
@@ -99,6 +167,12 @@ class McpServer(Base):
     created_at = Column(Integer, nullable=False)
     updated_at = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index("ix_mcp_owner_id", "owner_id"),
+        Index("ix_mcp_public_created_at", "created_at", "id",
+              postgresql_where=is_public, sqlite_where=is_public),
+    )
+
 
 
 class Order(Base):
@@ -115,6 +189,62 @@ class Order(Base):
     created_at = Column(Integer(), nullable=False)
     updated_at = Column(Integer(), nullable=False)
 
+    __table_args__ = (
+        Index("uq_order_out_trade_no", "out_trade_no", unique=True),
+    )
+
+
+class UsageEvent(Base):
+    '''
+    append-only ledger, one row per charged request
+    '''
+    __tablename__ = 'UsageEvent'
+    id = Column(Integer(), primary_key=True, index=True)
+    user_id = Column(Integer(), nullable=False)
+    model = Column(String(50), comment="model name")
+    provider = Column(String(20), comment="openai|anthropic|deepseek|...")
+    input_tokens = Column(Integer(), default=0)
+    output_tokens = Column(Integer(), default=0)
+    cost = Column(Float(), comment="credit charged", default=0.0)
+    chat_id = Column(Integer(), default=None)
+    latency_ms = Column(Integer(), comment="request duration", default=None)
+    created_at = Column(Integer(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_usage_event_user_id_created_at", "user_id", "created_at"),
+    )
+
+
+class UsageUserDaily(Base):
+    '''
+    usage per user and model per day, maintained with every UsageEvent
+    '''
+    __tablename__ = 'UsageUserDaily'
+    day = Column(Integer(), comment="utc midnight timestamp", primary_key=True)
+    user_id = Column(Integer(), primary_key=True)
+    model = Column(String(50), primary_key=True)
+    requests = Column(Integer(), default=0)
+    input_tokens = Column(BigInteger(), default=0)
+    output_tokens = Column(BigInteger(), default=0)
+    cost = Column(Float(), default=0.0)
+
+    __table_args__ = (
+        Index("ix_usage_user_daily_user_id_day", "user_id", "day"),
+    )
+
+
+class UsageModelDaily(Base):
+    '''
+    usage per model per day, maintained with every UsageEvent
+    '''
+    __tablename__ = 'UsageModelDaily'
+    day = Column(Integer(), comment="utc midnight timestamp", primary_key=True)
+    model = Column(String(50), primary_key=True)
+    requests = Column(Integer(), default=0)
+    input_tokens = Column(BigInteger(), default=0)
+    output_tokens = Column(BigInteger(), default=0)
+    cost = Column(Float(), default=0.0)
+
 
 class Shares(Base):
     '''
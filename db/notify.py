@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging as log
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+
+class MemoryBus:
+    '''
+    change notifications between the components and the in process caches.
+    components publish inside their session, subscribers are called once the
+    transaction commits with the payload dict, or with None when they may
+    have missed notifications and have to drop everything.
+    this one only reaches the current process, for tests and single worker
+    setups
+    '''
+    CHANNEL_PREFIX = "changes_"
+
+    def __init__(self):
+        self.subscribers = {}
+        # caches may rely on notifications only while this is set
+        self.listening = True
+
+    def subscribe(self, channel, cb):
+        self.subscribers.setdefault(channel, []).append(cb)
+
+    def publish(self, conn, channel, **payload):
+        '''
+        conn: the component session, nothing is sent if it rolls back
+        '''
+        event.listen(conn, "after_commit",
+                     lambda session: self.dispatch(channel, payload), once=True)
+
+    def dispatch(self, channel, payload):
+        for cb in self.subscribers.get(channel, []):
+            try:
+                cb(payload)
+            except Exception as err:
+                log.error(f"notify {channel} subscriber error: {err}")
+
+    def reset(self):
+        for channel in self.subscribers:
+            self.dispatch(channel, None)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class PGBus(MemoryBus):
+    '''
+    notifications through postgres NOTIFY, so they reach every worker.
+    pg_notify is transactional, it is delivered on commit and dropped on
+    rollback. each worker keeps one asyncpg connection LISTENing on the
+    subscribed channels and reconnects when it drops.
+    subscribe before start()
+    '''
+    RECONNECT_DELAY = 1
+    KEEPALIVE = 30
+
+    def __init__(self, db_url):
+        super().__init__()
+        self.dsn = make_url(db_url).set(drivername="postgresql").render_as_string(
+            hide_password=False)
+        self.listening = False
+        self._task = None
+
+    def publish(self, conn, channel, **payload):
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"), {
+            "channel": self.CHANNEL_PREFIX + channel,
+            "payload": json.dumps(payload),
+        })
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+        self.dispatch(channel[len(self.CHANNEL_PREFIX):], payload)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        import asyncpg
+
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda c: closed.set())
+                for channel in self.subscribers:
+                    await conn.add_listener(self.CHANNEL_PREFIX + channel, self._on_notify)
+                self.listening = True
+                # whatever was sent while not listening is lost
+                self.reset()
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), self.KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        await conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                log.error(f"notify listener error: {err}")
+            finally:
+                self.listening = False
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            self.reset()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def create_bus(db_url):
+    if db_url and make_url(db_url).get_backend_name() == "postgresql":
+        return PGBus(db_url)
+    return MemoryBus()
@@ -1,3 +1,6 @@
+import time
+
+from sqlalchemy import select
 from sqlalchemy.orm.attributes import flag_modified
 from db.base import DBConnectorComponent
 from db.model import Order
@@ -8,26 +11,20 @@ class OrderDBConnectorComponent(DBConnectorComponent):
     Order component which is used to manager all Order db interface
     '''
     tbl = Order
+    UNPAID = 0
+    PAID = 1
 
     def get_all_orders(self):
         def thd(conn):
-            try:
-                orders = conn.query(self.tbl).order_by(self.tbl.created_at).all()
-            except Exception as err:
-                print(f"get all orders err: {err}")
-            return [od.to_dict() for od in orders]
-        d = self.db.execute(thd)
+            return self._rows(conn, select(*self._columns()).order_by(self.tbl.created_at))
+        d = self.db.read(thd)
         return d
 
     def get_orders_by_owner_id(self, owner_id):
         def thd(conn):
-            try:
-                ods = conn.query(self.tbl).filter(
-                    self.tbl.owner_id == owner_id).all()
-            except Exception as err:
-                print(f"get ods err: {err}")
-            return [od.to_dict() for od in ods]
-        d = self.db.execute(thd)
+            return self._rows(conn, select(*self._columns()).where(
+                self.tbl.user_id == owner_id))
+        d = self.db.read(thd)
         return d
 
     def get_order_by_out_trade_no(self, out_trade_no):
@@ -38,6 +35,47 @@ class OrderDBConnectorComponent(DBConnectorComponent):
         d = self.db.execute(thd)
         return d
 
+    def complete_order(self, out_trade_no, money, check_money=None, updated_at=None):
+        '''
+        mark the order paid and credit its user in one transaction.
+        the order row is locked, so concurrent notifies for the same order
+        are serialized and only the first one credits
+        money: credit to add
+        check_money: callable(order money) -> bool, checked under the lock
+        return: (result, order), result is one of
+            "success", "repeated", "not_found", "money_error"
+        '''
+        def thd(conn):
+            # repeated notifies end here, one lookup on the unique index
+            status = conn.query(self.tbl.status).filter(
+                self.tbl.out_trade_no == out_trade_no).scalar()
+            if status is None:
+                return "not_found", None
+            if status == self.PAID:
+                return "repeated", None
+            od = conn.query(self.tbl).filter(
+                self.tbl.out_trade_no == out_trade_no).with_for_update().first()
+            if od.status == self.PAID:
+                return "repeated", od.to_dict()
+            if check_money is not None and not check_money(od.money):
+                return "money_error", od.to_dict()
+            now = updated_at or int(time.time())
+            # guarded transition, also holds where FOR UPDATE is a no-op (sqlite)
+            paid = conn.query(self.tbl).filter(
+                self.tbl.id == od.id, self.tbl.status == self.UNPAID).update(
+                    {self.tbl.status: self.PAID, self.tbl.updated_at: now},
+                    synchronize_session=False)
+            if paid != 1:
+                conn.rollback()
+                return "repeated", None
+            self.db.user.add_credit_in(conn, od.user_id, money, now)
+            data = od.to_dict()
+            conn.commit()
+            data.status, data.updated_at = self.PAID, now
+            return "success", data
+        d = self.db.execute(thd)
+        return d
+
     def add_new_order(self, **kwargs):
         def thd(conn):
             try:
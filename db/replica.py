@@ -0,0 +1,124 @@
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import text
+
+# replay delay in seconds, 0 when the replica has applied all it received
+LAG_SQL = text('''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+''')
+
+# reads stay on the primary until then, see pin() and on_primary()
+_primary_until = ContextVar("primary_until", default=0.0)
+# user the current request acts for, see as_user()
+_user = ContextVar("db_user", default=None)
+
+
+class ReplicaLagging(Exception):
+    pass
+
+
+class Replica:
+    '''
+    one read replica with its measured replication lag
+    '''
+
+    def __init__(self, url, engine, Session):
+        self.url = url
+        self.engine = engine
+        self.Session = Session
+        self.lag = None
+        self.checked_at = 0.0
+        self.failed_at = 0.0
+
+    def due(self, interval):
+        return time.monotonic() - self.checked_at >= interval
+
+    def usable(self, max_lag, check_interval, retry):
+        if time.monotonic() - self.failed_at < retry:
+            return False
+        # a lagging replica is tried again once its lag is due for a check
+        return self.lag is None or self.lag <= max_lag or self.due(check_interval)
+
+    def guard(self, f, max_lag, check_interval):
+        '''
+        wrap the component closure, measure the lag first when it is due
+        and refuse to read if the replica is behind
+        '''
+        def thd(session):
+            if self.lag is None or self.due(check_interval):
+                self.lag = float(session.execute(LAG_SQL).scalar() or 0)
+                self.checked_at = time.monotonic()
+            if self.lag > max_lag:
+                raise ReplicaLagging(f"replica lag {self.lag:.1f}s")
+            return f(session)
+        return thd
+
+    def fail(self):
+        self.failed_at = time.monotonic()
+
+
+def pinned():
+    return time.monotonic() < _primary_until.get()
+
+
+def pin(seconds):
+    '''
+    keep the reads of the current request/task on the primary for a while
+    after it wrote, so it reads its own writes
+    '''
+    until = time.monotonic() + seconds
+    if until > _primary_until.get():
+        _primary_until.set(until)
+
+
+@contextmanager
+def on_primary():
+    '''
+    run every read inside the block on the primary
+    '''
+    token = _primary_until.set(float("inf"))
+    try:
+        yield
+    finally:
+        _primary_until.reset(token)
+
+
+def as_user(user_id):
+    '''
+    the current request/task acts for user_id, see RecentWrites
+    '''
+    _user.set(user_id)
+
+
+def current_user():
+    return _user.get()
+
+
+class RecentWrites:
+    '''
+    users who wrote lately, until when their reads stay on the primary,
+    so the reads of a later request see the writes of an earlier one.
+    kept per process, like the users' requests are routed
+    '''
+    PRUNE_SIZE = 10000
+
+    def __init__(self):
+        self.until = {}
+
+    def add(self, user_id, seconds):
+        if user_id is None:
+            return
+        now = time.monotonic()
+        if len(self.until) >= self.PRUNE_SIZE:
+            self.until = {user: until for user, until in self.until.items() if until > now}
+        self.until[user_id] = now + seconds
+
+    def pinned(self, user_id):
+        return user_id is not None and time.monotonic() < self.until.get(user_id, 0.0)
@@ -1,3 +1,6 @@
+import copy
+
+from sqlalchemy import case, update
 from sqlalchemy.orm.attributes import flag_modified
 from db.base import DBConnectorComponent
 from db.model import Shares
@@ -9,13 +12,50 @@ class SharesDBConnectorComponent(DBConnectorComponent):
     '''
     tbl = Shares
 
+    def __init__(self, connector):
+        super().__init__(connector)
+        # the singleton row, read on every catalog request. kept until a
+        # change is published, so only while the bus is listening
+        self.cached = None
+        # bumped on every change, a read only fills the cache if no change
+        # came in while it ran
+        self.generation = 0
+        connector.notify.subscribe("shares", self._on_change)
+
+    def _on_change(self, payload=None):
+        self.generation += 1
+        self.cached = None
+
     def get_all_shares(self):
+        if self.cached is not None and self.db.notify.listening:
+            return self.db.result(copy.copy(self.cached))
+        generation = self.generation
         def thd(conn):
             try:
                 shares = conn.query(self.tbl).first()
             except Exception as err:
                 print(f"get all bots err: {err}")
-            return shares.to_dict()
+            data = shares.to_dict()
+            if self.generation == generation:
+                self.cached = copy.copy(data)
+            return data
+        d = self.db.execute(thd)
+        return d
+
+    def touch(self, column, updated_at):
+        '''
+        move a catalog version (bot_updated, mcp_updated) to updated_at in a
+        single UPDATE, always forward even for changes in the same second
+        '''
+        def thd(conn):
+            col = getattr(self.tbl, column)
+            conn.execute(update(self.tbl).values({
+                col: case((col >= updated_at, col + 1), else_=updated_at),
+            }).execution_options(synchronize_session=False))
+            self.db.notify.publish(conn, "shares", column=column)
+            conn.commit()
+            self._on_change()
+            return updated_at
         d = self.db.execute(thd)
         return d
 
@@ -27,7 +67,9 @@ class SharesDBConnectorComponent(DBConnectorComponent):
                     mcp_updated=kwargs.get("mcp_updated", None),
                 )
                 conn.add(shares)
+                self.db.notify.publish(conn, "shares")
                 conn.commit()
+                self._on_change()
             except Exception as err:
                 print("add chat err: ", err)
             return shares.id
@@ -44,7 +86,9 @@ class SharesDBConnectorComponent(DBConnectorComponent):
                 if val is not None:
                     setattr(shares, col, val)
                     flag_modified(shares, col)
+            self.db.notify.publish(conn, "shares")
             conn.commit()
+            self._on_change()
             return shares.id
         d = self.db.execute(thd)
         return d
\ No newline at end of file
@@ -0,0 +1,120 @@
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from db.base import DBConnectorComponent
+from db.model import UsageEvent, UsageUserDaily, UsageModelDaily
+
+DAY = 24 * 3600
+
+
+class UsageDBConnectorComponent(DBConnectorComponent):
+    '''
+    usage component which is used to manager the usage ledger and its
+    daily rollups
+    '''
+    tbl = UsageEvent
+    user_daily_tbl = UsageUserDaily
+    model_daily_tbl = UsageModelDaily
+    ROLLUP_COLUMNS = ["requests", "input_tokens", "output_tokens", "cost"]
+
+    def _upsert(self, conn, tbl, keys, rows):
+        '''
+        add rows onto the existing rollup rows with the same keys
+        '''
+        if not rows:
+            return
+        dialect = conn.get_bind().dialect.name
+        if dialect == "postgresql":
+            stmt = postgresql.insert(tbl.__table__)
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(tbl.__table__)
+        else:
+            raise NotImplementedError(f"rollup upsert is not supported on {dialect}")
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={col: tbl.__table__.c[col] + stmt.excluded[col] for col in self.ROLLUP_COLUMNS},
+        )
+        conn.connection().execute(stmt, rows)
+
+    def _rollup(self, events, keys):
+        rows = {}
+        for ev in events:
+            day = ev["created_at"] - ev["created_at"] % DAY
+            key = (day,) + tuple(ev[k] for k in keys)
+            row = rows.setdefault(key, dict(
+                zip(("day",) + tuple(keys), key),
+                requests=0, input_tokens=0, output_tokens=0, cost=0.0))
+            row["requests"] += 1
+            row["input_tokens"] += ev.get("input_tokens") or 0
+            row["output_tokens"] += ev.get("output_tokens") or 0
+            row["cost"] += ev.get("cost") or 0.0
+        return list(rows.values())
+
+    def add_usage_events_in(self, conn, events):
+        '''
+        append events to the ledger and the daily rollups inside the
+        caller's session, the caller commits
+        '''
+        if not events:
+            return 0
+        conn.execute(insert(self.tbl), events)
+        self._upsert(conn, self.user_daily_tbl, ["day", "user_id", "model"],
+                     self._rollup(events, ["user_id", "model"]))
+        self._upsert(conn, self.model_daily_tbl, ["day", "model"],
+                     self._rollup(events, ["model"]))
+        return len(events)
+
+    def charge_usage(self, costs, events, updated_at=None):
+        '''
+        deduct credits and record the usage in one transaction,
+        so a retried batch is never charged or recorded twice
+        costs: dict, key: user id, value: cost
+        events: list of UsageEvent dicts
+        '''
+        def thd(conn):
+            if costs:
+                self.db.user.deduct_credits_in(conn, costs, updated_at)
+            res = self.add_usage_events_in(conn, events)
+            conn.commit()
+            return res
+        d = self.db.execute(thd)
+        return d
+
+    def get_user_daily(self, user_id, start=None, end=None, model=None):
+        def thd(conn):
+            tbl = self.user_daily_tbl
+            stmt = select(*self._columns(tbl=tbl)).where(tbl.user_id == user_id)
+            if model:
+                stmt = stmt.where(tbl.model == model)
+            if start is not None:
+                stmt = stmt.where(tbl.day >= start - start % DAY)
+            if end is not None:
+                stmt = stmt.where(tbl.day <= end)
+            return self._rows(conn, stmt.order_by(tbl.day, tbl.model))
+        d = self.db.read(thd)
+        return d
+
+    def get_model_daily(self, start=None, end=None, model=None):
+        def thd(conn):
+            tbl = self.model_daily_tbl
+            stmt = select(*self._columns(tbl=tbl))
+            if model:
+                stmt = stmt.where(tbl.model == model)
+            if start is not None:
+                stmt = stmt.where(tbl.day >= start - start % DAY)
+            if end is not None:
+                stmt = stmt.where(tbl.day <= end)
+            return self._rows(conn, stmt.order_by(tbl.day, tbl.model))
+        d = self.db.read(thd)
+        return d
+
+    def get_usage_events(self, user_id, start=None, end=None, limit=100):
+        def thd(conn):
+            stmt = select(*self._columns()).where(self.tbl.user_id == user_id)
+            if start is not None:
+                stmt = stmt.where(self.tbl.created_at >= start)
+            stmt = stmt.where(self.tbl.created_at <= (end or int(time.time())))
+            return self._rows(conn, stmt.order_by(self.tbl.created_at.desc()).limit(limit))
+        d = self.db.read(thd)
+        return d
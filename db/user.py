@@ -1,5 +1,11 @@
+import copy
+import time
+
+from dictns import Namespace
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm.attributes import flag_modified
 from db.base import DBConnectorComponent
+from db.cache import TTLCache
 from db.model import User
 
 
@@ -8,15 +14,36 @@ class UserDBConnectorComponent(DBConnectorComponent):
     user component which is used to manager all user db interface
     '''
     tbl = User
+    CACHE_SIZE = 10000
+    CACHE_TTL = 60
+
+    def __init__(self, connector):
+        super().__init__(connector)
+        # users by id, refreshed by every write through this component and
+        # dropped on the changes other workers publish
+        self.cache = TTLCache(self.CACHE_SIZE, self.CACHE_TTL)
+        # bumped on every change, a read only fills the cache if no change
+        # came in while it ran
+        self.generation = 0
+        connector.notify.subscribe("user", self._on_change)
+
+    def _on_change(self, payload):
+        if payload is None:
+            self.generation += 1
+            self.cache.clear()
+        else:
+            self.invalidate(payload.get("ids", []))
+
+    def _cache_key(self, user_id):
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return user_id
 
     def get_all_users(self):
         def thd(conn):
-            try:
-                users = conn.query(self.tbl).all()
-            except Exception as err:
-                print(f"get all users err: {err}")
-            return [user.to_dict() for user in users]
-        d = self.db.execute(thd)
+            return self._rows(conn, select(*self._columns("pwd")).order_by(self.tbl.id))
+        d = self.db.read(thd)
         return d
 
     def get_user_by_email(self, email):
@@ -31,10 +58,19 @@ class UserDBConnectorComponent(DBConnectorComponent):
         return d
 
     def get_user_by_id(self, user_id):
+        user = self.cache.get(self._cache_key(user_id))
+        if user is not None:
+            return self.db.result(copy.copy(user))
+        generation = self.generation
         def thd(conn):
             user = conn.query(self.tbl).filter(
                 self.tbl.id == user_id).first()
-            return user.to_dict() if user else None
+            if user is None:
+                return None
+            data = user.to_dict()
+            if self.generation == generation:
+                self.cache.set(self._cache_key(user_id), copy.copy(data))
+            return data
         d = self.db.execute(thd)
         return d
 
@@ -81,8 +117,83 @@ class UserDBConnectorComponent(DBConnectorComponent):
                 if val is not None:
                     setattr(user, col, val)
                     flag_modified(user, col)
+            self.db.notify.publish(conn, "user", ids=[user.id])
+            conn.commit()
+            data = user.to_dict()
+            self.cache.set(self._cache_key(user_id), copy.copy(data))
+            return data
+        d = self.db.execute(thd)
+        return d
+
+    def add_credit_in(self, conn, user_id, amount, updated_at=None):
+        '''
+        credit = credit + amount in a single UPDATE ... RETURNING,
+        so concurrent charges never overwrite each other.
+        inside the caller's session, the caller commits
+        '''
+        stmt = update(self.tbl).where(self.tbl.id == user_id).values(
+            credit=func.coalesce(self.tbl.credit, 0) + amount,
+            updated_at=updated_at or int(time.time()),
+        ).returning(*self.tbl.__table__.columns).execution_options(
+            synchronize_session=False)
+        row = conn.execute(stmt).first()
+        if row is None:
+            return None
+        self.db.notify.publish(conn, "user", ids=[row.id])
+        return Namespace(dict(row._mapping))
+
+    def touch_in(self, conn, user_id, updated_at):
+        '''
+        set updated_at only, inside the caller's session, the caller commits
+        and drops the cached user
+        '''
+        conn.execute(update(self.tbl).where(self.tbl.id == user_id).values(
+            updated_at=updated_at).execution_options(synchronize_session=False))
+        self.db.notify.publish(conn, "user", ids=[user_id])
+
+    def add_credit_by_id(self, user_id, amount, updated_at=None):
+        def thd(conn):
+            data = self.add_credit_in(conn, user_id, amount, updated_at)
+            if data is None:
+                return None
+            conn.commit()
+            self.cache.set(self._cache_key(user_id), copy.copy(data))
+            return data
+        d = self.db.execute(thd)
+        return d
+
+    def deduct_credit_by_id(self, user_id, cost, updated_at=None):
+        return self.add_credit_by_id(user_id, -cost, updated_at)
+
+    def invalidate(self, user_ids):
+        self.generation += 1
+        for user_id in user_ids:
+            self.cache.pop(self._cache_key(user_id))
+
+    def deduct_credits_in(self, conn, costs, updated_at=None):
+        '''
+        deduct_credits inside the caller's session, the caller commits
+        '''
+        tbl = self.tbl.__table__
+        stmt = update(tbl).where(tbl.c.id == bindparam("b_id")).values(
+            credit=func.coalesce(tbl.c.credit, 0) - bindparam("b_cost"),
+            updated_at=updated_at or int(time.time()),
+        )
+        # fixed lock order, concurrent flushes can not deadlock
+        params = [{"b_id": user_id, "b_cost": cost}
+                  for user_id, cost in sorted(costs.items())]
+        self.db.notify.publish(conn, "user", ids=list(costs.keys()))
+        return conn.connection().execute(stmt, params).rowcount
+
+    def deduct_credits(self, costs, updated_at=None):
+        '''
+        charge many users in one transaction
+        costs: dict, key: user id, value: cost
+        '''
+        def thd(conn):
+            result = self.deduct_credits_in(conn, costs, updated_at)
             conn.commit()
-            return user.to_dict()
+            return result
         d = self.db.execute(thd)
         return d
 
@@ -91,6 +202,7 @@ class UserDBConnectorComponent(DBConnectorComponent):
             try:
                 result = conn.query(self.tbl).filter(
                     self.tbl.id == user_id).delete()
+                self.db.notify.publish(conn, "user", ids=[user_id])
                 conn.commit()
             except Exception as err:
                 print("delete user error: ", err)
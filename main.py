@@ -1,9 +1,16 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI, APIRouter
 from fastapi.responses import PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from api.v1 import api_router
+from api.v1.chatdb import chat_buffer
+from api.deps import db_client
+from api.responses import JSONResponse
+from utils.archive import ChatArchiver
+from utils.credit import Credit
 from core.config import settings
 
 
@@ -13,10 +20,37 @@ root = APIRouter()
 def read_root() -> dict:
     return PlainTextResponse("test chatgpt by fan")
 
+@root.get("/metrics")
+def read_metrics():
+    # prometheus text format
+    body = db_client.metrics.render() if db_client else ""
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if db_client:
+        if settings.DB_BACKEND == "sqlite":
+            await db_client.create_all()
+        await db_client.notify.start()
+    archiver = None
+    if db_client and db_client.archive is not None and settings.ARCHIVE_INTERVAL:
+        archiver = ChatArchiver(db_client, settings.ARCHIVE_AFTER_DAYS, settings.ARCHIVE_INTERVAL)
+        archiver.start()
+    yield
+    await chat_buffer.close()
+    if archiver:
+        await archiver.close()
+    if Credit.usage:
+        await Credit.usage.close()
+    if db_client:
+        await db_client.close_connect()
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title=settings.PROJECT_NAME,
-        openapi_url=f"{settings.API_V1_STR}/openapi.json"
+        openapi_url=f"{settings.API_V1_STR}/openapi.json",
+        lifespan=lifespan,
+        default_response_class=JSONResponse,
     )
     app.include_router(root)
     app.include_router(api_router, prefix=settings.API_V1_STR)
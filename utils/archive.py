@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from utils import log
+
+
+log = log.Logger(__name__, clevel=log.logging.DEBUG)
+
+class ChatArchiver:
+    '''
+    background job moving the messages of chats inactive for after_days to
+    the blob store, every interval seconds, in batches until none are left.
+    every worker may run it, a batch skips the chats another one has locked
+    '''
+
+    def __init__(self, db, after_days=90, interval=3600):
+        self.db = db
+        self.after = after_days * 24 * 3600
+        self.interval = interval
+        self._task = None
+
+    async def run_once(self):
+        before = int(time.time()) - self.after
+        total = 0
+        while True:
+            count = await self.db.chat.archive_chats(before)
+            if not count:
+                return total
+            total += count
+
+    async def _run(self):
+        while True:
+            try:
+                count = await self.run_once()
+                if count:
+                    log.debug(f"archived {count} chats")
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                log.error(f"archive chats error: {err}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
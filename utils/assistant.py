@@ -3,6 +3,7 @@ from openai import AsyncOpenAI, AssistantEventHandler
 import tiktoken
 from retry import retry
 import os
+import time
 
 from core.config import settings
 from .credit import Credit
@@ -198,6 +199,7 @@ class Assistant:
             params["temperature"] = message.temperature
         #params["response_format"] = { "type": "json_object" }
         input_tokens = output_tokens = 0
+        start = time.time()
         async with self.client.beta.threads.runs.stream(
             thread_id=thread_id,
             assistant_id=assistant_id,
@@ -210,7 +212,9 @@ class Assistant:
                     input_tokens = event.data.usage.prompt_tokens
                     output_tokens = event.data.usage.completion_tokens
                 yield event.model_dump_json(exclude_unset=True)
-        self.credit.from_tokens(user_id, "gpt-4o", input_tokens, output_tokens)
+        await self.credit.from_tokens(
+            user_id, "gpt-4o", input_tokens, output_tokens, provider="openai",
+            latency_ms=int((time.time() - start) * 1000))
 
     async def send_msg_and_run(self,
             assistant_id,
@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+from utils import log
+
+
+log = log.Logger(__name__, clevel=log.logging.DEBUG)
+
+# saved from the chat save request, everything else is a column
+CONTENT_KEYS = ("contents", "start_seq")
+
+class ChatWriteBuffer:
+    '''
+    write-behind buffer of chat saves (update_chat_by_id) keyed by chat id.
+    saves of a chat arriving within window_ms of the first one are merged
+    and written once, reads of this process see them through overlay().
+    the buffer lives in the process: with several workers, route a user to
+    one of them or set window_ms to 0, which writes every save directly
+    '''
+    MAX_RETRIES = 3
+
+    def __init__(self, db, window_ms=1000):
+        self.db = db
+        self.window = window_ms / 1000
+        # chat id: merged update_chat_by_id kwargs
+        self.pending = {}
+        self.inflight = {}
+        self.saves = 0
+        self.writes = 0
+        self._failures = {}
+        self._tasks = {}
+        self._locks = {}
+        self._closed = False
+
+    @staticmethod
+    def merge(old, new):
+        '''
+        one save with the effect of old then new.
+        contents are the messages from start_seq on, None meaning the whole
+        history, the database clamps a start_seq past the end to the end
+        '''
+        merged = dict(old)
+        merged.update({k: v for k, v in new.items() if v is not None and k not in CONTENT_KEYS})
+        if new.get("contents") is None:
+            return merged
+        old_start, new_start = old.get("start_seq"), new.get("start_seq")
+        if old.get("contents") is None or new_start is None or (
+                old_start is not None and new_start < old_start):
+            merged["contents"], merged["start_seq"] = new["contents"], new_start
+        else:
+            keep = max(new_start - (old_start or 0), 0)
+            merged["contents"] = old["contents"][:keep] + new["contents"]
+        return merged
+
+    async def save(self, chat_id, **kwargs):
+        '''
+        update_chat_by_id, buffered
+        '''
+        if self.window <= 0 or self._closed:
+            return await self.db.chat.update_chat_by_id(chat_id, **kwargs)
+        self.saves += 1
+        pending = self.pending.get(chat_id)
+        self.pending[chat_id] = kwargs if pending is None else self.merge(pending, kwargs)
+        self._schedule(chat_id)
+        return chat_id
+
+    def _schedule(self, chat_id):
+        # after close() the remaining retries are done there
+        if chat_id not in self._tasks and not self._closed:
+            self._tasks[chat_id] = asyncio.get_running_loop().create_task(
+                self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id):
+        await asyncio.sleep(self.window)
+        self._tasks.pop(chat_id, None)
+        await self.flush(chat_id)
+
+    async def flush(self, chat_id):
+        '''
+        write the buffered saves of the chat now, before any other write to it
+        '''
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            kwargs = self.pending.pop(chat_id, None)
+            if kwargs is None:
+                return
+            # later than any sync cursor handed out while it was buffered
+            kwargs["updated_at"] = max(kwargs.get("updated_at") or 0, int(time.time()))
+            self.inflight[chat_id] = kwargs
+            try:
+                res = await self.db.chat.update_chat_by_id(chat_id, **kwargs)
+            except Exception as err:
+                log.error(f"chat {chat_id} buffered save error: {err}")
+                res = None
+            finally:
+                self.inflight.pop(chat_id, None)
+            if res:
+                self.writes += 1
+                self._failures.pop(chat_id, None)
+            else:
+                failures = self._failures.get(chat_id, 0) + 1
+                if failures < self.MAX_RETRIES:
+                    self._failures[chat_id] = failures
+                    newer = self.pending.get(chat_id)
+                    self.pending[chat_id] = kwargs if newer is None else self.merge(kwargs, newer)
+                    self._schedule(chat_id)
+                else:
+                    self._failures.pop(chat_id, None)
+                    log.error(f"chat {chat_id} buffered save dropped after {failures} tries")
+        if not lock.locked() and chat_id not in self.pending:
+            self._locks.pop(chat_id, None)
+
+    def discard(self, chat_id):
+        '''
+        drop the buffered saves of a deleted chat
+        '''
+        self.pending.pop(chat_id, None)
+        task = self._tasks.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+
+    def overlay(self, chat):
+        '''
+        apply the buffered saves to a chat dict read from the database,
+        with contents (get_chat_by_id) or as a summary (get_chat_summaries)
+        '''
+        for source in (self.inflight, self.pending):
+            kwargs = source.get(chat["id"])
+            if not kwargs:
+                continue
+            for key, val in kwargs.items():
+                if key not in CONTENT_KEYS and key in chat and val is not None:
+                    chat[key] = val
+            contents, start = kwargs.get("contents"), kwargs.get("start_seq")
+            if contents is None:
+                continue
+            if "contents" in chat:
+                stored = chat["contents"] or []
+                chat["contents"] = contents if start is None else stored[:start] + contents
+            elif "message_count" in chat:
+                count = chat["message_count"]
+                chat["message_count"] = len(contents) if start is None else min(start, count) + len(contents)
+                if contents:
+                    chat["snippet"] = self.db.chat._snippet(contents[-1])
+        return chat
+
+    async def close(self):
+        '''
+        write everything buffered, wait for the writes in flight
+        '''
+        self._closed = True
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+        for _ in range(self.MAX_RETRIES):
+            for chat_id in list(self.pending) + list(self.inflight):
+                await self.flush(chat_id)
+            if not self.pending:
+                break
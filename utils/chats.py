@@ -80,7 +80,7 @@ class Chat:
         log.debug(f"token input: {input_token}, output: {output_token}")
         return input_token, output_token
 
-    def credit_balance(self, user_id, chat, is_new):
+    async def credit_balance(self, user_id, chat, is_new):
         userinfo = None
         try:
             model, messages = chat.model, chat.contents
@@ -88,20 +88,11 @@ class Chat:
             input_price = (input_token * self.PRICE[model]["input"] / 1000000) * self.EXCH_RATE
             output_price = (output_token * self.PRICE[model]["output"] / 1000000) * self.EXCH_RATE
             log.debug(f"price input: {input_price}, output: {output_price}")
-            user = db_client.user.get_user_by_id(user_id)
-            if user.credit is None:
-                user.credit = 0
-            new_credit = user.credit - input_price * 1.2 - output_price * 1.2
+            cost = input_price * 1.2 + output_price * 1.2
             if is_new and chat.assistant_id is not None:
-                new_credit = new_credit - 0.22
-            newdata = {
-                "credit": new_credit,
-                "updated_at": int(time.time())
-            }
-            userinfo = db_client.user.update_user_by_id(
-                user_id,
-                **newdata,
-            )
+                cost = cost + 0.22
+            userinfo = await db_client.user.deduct_credit_by_id(
+                user_id, cost, int(time.time()))
         except Exception as err:
             log.debug(f"credit_balance error:{err}")
         return userinfo
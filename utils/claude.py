@@ -4,6 +4,7 @@ from retry import retry
 import httpx
 import base64
 import logging
+import time
 
 from tenacity import (
     retry,
@@ -86,8 +87,8 @@ class Claude:
         if getattr(response, 'usage', None):
             input_tokens = getattr(response.usage, 'input_tokens', 0)
             output_tokens = getattr(response.usage, 'output_tokens', 0)
-        self.credit.from_tokens(
-                user_id, model, input_tokens, output_tokens)
+        await self.credit.from_tokens(
+                user_id, model, input_tokens, output_tokens, provider="anthropic")
         return response.content[0].text
 
     @retry(
@@ -150,17 +151,25 @@ class Claude:
             log.debug(f"\033[31mtemperature: {chat_completion.temperature}\033[0m")
         # with self.client.messages.stream(
         resp = None
+        start = time.time()
         try:
             resp = await self.client.messages.create(
                 **params,
                 timeout=httpx.Timeout(30.0),
             )
             async for x in resp:
-                if getattr(x, 'usage', None):
-                    input_tokens = getattr(x.usage, 'input_tokens', 0)
-                    output_tokens = getattr(x.usage, 'output_tokens', 0)
-                    self.credit.from_tokens(user_id, model, input_tokens, output_tokens)
+                # message_start carries the input tokens, message_delta the
+                # running output total, charge once when the stream ends
+                usage = getattr(x, 'usage', None)
+                if usage is None and getattr(x, 'message', None):
+                    usage = getattr(x.message, 'usage', None)
+                if usage:
+                    input_tokens = getattr(usage, 'input_tokens', None) or input_tokens
+                    output_tokens = getattr(usage, 'output_tokens', None) or output_tokens
                 yield x.model_dump_json(exclude_unset=True)
+            await self.credit.from_tokens(
+                user_id, model, input_tokens, output_tokens, provider="anthropic",
+                chat_id=chat_completion.chat_id, latency_ms=int((time.time() - start) * 1000))
         except Exception as e:
             log.error(f"API error: {e}")
             raise
@@ -1,6 +1,8 @@
 import time
 from api.deps import db_client
+from core.config import settings
 from utils import log
+from utils.usage import UsageAccumulator
 
 
 log = log.Logger(__name__, clevel=log.logging.DEBUG)
@@ -31,53 +33,70 @@ class Credit:
         "gemini-2.0-flash-001":       {"input": 0.10, "output": 0.40}, # free
     }
     defalt_price = {"input": 10.0, "output": 30.0}
+    # shared by every provider wrapper, see flush_usage
+    usage = None
 
-    def from_tokens(self, user_id, model, input_tokens, output_tokens):
+    def __init__(self) -> None:
+        if Credit.usage is None:
+            Credit.usage = UsageAccumulator(
+                Credit.flush_usage,
+                flush_ms=settings.USAGE_FLUSH_MS,
+                flush_events=settings.USAGE_FLUSH_EVENTS,
+            )
+
+    @classmethod
+    def cost_of_tokens(cls, model, input_tokens, output_tokens):
+        price = cls.PRICE.get(model, cls.defalt_price)
+        input_cost = cls.EXCH_RATE * (input_tokens * price["input"])/1000000
+        output_cost = cls.EXCH_RATE * (output_tokens * price["output"])/1000000
+        return input_cost * 1.2 + output_cost * 1.2
+
+    @classmethod
+    async def flush_usage(cls, pending, ledger):
         """
+        charge the accumulated usage and write the ledger,
+        one transaction for the whole batch
+        pending: dict, key: (user_id, model), value: [input_tokens, output_tokens]
+        ledger: list of UsageEvent dicts, events without cost are charged here
+        either may be empty when the accumulator splits a failing batch
+        """
+        costs = {}
+        for (user_id, model), (input_tokens, output_tokens) in pending.items():
+            cost = cls.cost_of_tokens(model, input_tokens, output_tokens)
+            costs[user_id] = costs.get(user_id, 0) + cost
+        for event in ledger:
+            if event.get("cost") is None:
+                event["cost"] = cls.cost_of_tokens(
+                    event["model"], event["input_tokens"], event["output_tokens"])
+        res = await db_client.usage.charge_usage(costs, ledger, int(time.time()))
+        log.debug(f"***flush_usage: {len(pending)} charges, {res} events")
+        return res != ''
+
+    async def from_tokens(self, user_id, model, input_tokens, output_tokens,
+                          provider=None, chat_id=None, latency_ms=None):
+        """
+        queue the usage, it is charged by the next flush_usage
         """
-        userinfo = None
         try:
-            user = db_client.user.get_user_by_id(user_id)
-            if user.credit is None:
-                user.credit = 0
-            price = self.PRICE.get(model, self.defalt_price)
-            input_cost = self.EXCH_RATE * (input_tokens * price["input"])/1000000
-            output_cost = self.EXCH_RATE * (output_tokens * price["output"])/1000000
-            new_credit = user.credit - input_cost * 1.2 - output_cost * 1.2
-            newdata = {
-                "credit": new_credit,
-                "updated_at": int(time.time())
-            }
-            userinfo = db_client.user.update_user_by_id(
-                user_id,
-                **newdata,
-            )
-            #log.debug(f"***from_tokens: model: {model}, {price}")
+            self.usage.add(user_id, model, input_tokens, output_tokens,
+                           provider=provider, chat_id=chat_id, latency_ms=latency_ms)
             log.debug(f"***from_tokens: {input_tokens}, {output_tokens}")
-            #log.debug(f"***from_tokens: {user.credit}, {new_credit}")
         except Exception as err:
             log.debug(f"from_tokens error:{err}")
-        return userinfo
-    
-    def from_costs(self, user_id, cost):
+        return None
+
+    async def from_costs(self, user_id, cost, model="other", provider=None, chat_id=None):
         """
         cost unit: $
         """
         userinfo = None
         try:
-            user = db_client.user.get_user_by_id(user_id)
-            if user.credit is None:
-                user.credit = 0
-            new_credit = user.credit - self.EXCH_RATE * cost
-            newdata = {
-                "credit": new_credit,
-                "updated_at": int(time.time())
-            }
-            userinfo = db_client.user.update_user_by_id(
-                user_id,
-                **newdata,
-            )
-            log.debug(f"***from_costs: {user.credit}, {new_credit}")
+            credit_cost = self.EXCH_RATE * cost
+            userinfo = await db_client.user.deduct_credit_by_id(user_id, credit_cost)
+            if userinfo:
+                self.usage.record(user_id=user_id, model=model, provider=provider,
+                                  cost=credit_cost, chat_id=chat_id)
+            log.debug(f"***from_costs: {cost}, {userinfo.credit if userinfo else None}")
         except Exception as err:
             log.debug(f"from_costs error:{err}")
         return userinfo
@@ -1,3 +1,4 @@
+import time
 from openai import AsyncOpenAI
 import tiktoken
 from retry import retry
@@ -41,8 +42,8 @@ class DeepSeek:
         if getattr(response, 'usage', None):
             input_tokens = getattr(response.usage, 'prompt_tokens', 0)
             output_tokens = getattr(response.usage, 'completion_tokens', 0)
-        self.credit.from_tokens(
-                user_id, model, input_tokens, output_tokens)
+        await self.credit.from_tokens(
+                user_id, model, input_tokens, output_tokens, provider="deepseek")
         return response.choices[0].message.content
 
     @retry(tries=3, delay=1, backoff=1)
@@ -54,6 +55,7 @@ class DeepSeek:
         model = chat_completion.model
         messages = chat_completion.messages
         stream = True
+        start = time.time()
         # if model not in self.supported_models:
         #     model = self.supported_models[1]
 
@@ -78,4 +80,6 @@ class DeepSeek:
                 input_tokens = chunk.usage.prompt_tokens
                 output_tokens = chunk.usage.completion_tokens
             yield chunk.model_dump_json(exclude_unset=True)
-        self.credit.from_tokens(user_id, model, input_tokens, output_tokens)
+        await self.credit.from_tokens(
+            user_id, model, input_tokens, output_tokens, provider="deepseek",
+            chat_id=chat_completion.chat_id, latency_ms=int((time.time() - start) * 1000))
@@ -1,3 +1,4 @@
+import time
 from openai import AsyncOpenAI
 import tiktoken
 from retry import retry
@@ -47,8 +48,8 @@ class GPT:
         if getattr(response, 'usage', None):
             input_tokens = getattr(response.usage, 'prompt_tokens', 0)
             output_tokens = getattr(response.usage, 'completion_tokens', 0)
-        self.credit.from_tokens(
-                user_id, model, input_tokens, output_tokens)
+        await self.credit.from_tokens(
+                user_id, model, input_tokens, output_tokens, provider="openai")
         return response.choices[0].message.content
 
     @retry(tries=3, delay=1, backoff=1)
@@ -61,6 +62,7 @@ class GPT:
         messages = chat_completion.messages
         tools = chat_completion.tools
         stream = True
+        start = time.time()
         # if model not in self.supported_models:
         #     model = self.supported_models[1]
 
@@ -86,7 +88,9 @@ class GPT:
                 input_tokens = chunk.usage.prompt_tokens
                 output_tokens = chunk.usage.completion_tokens
             yield chunk.model_dump_json(exclude_unset=True)
-        self.credit.from_tokens(user_id, model, input_tokens, output_tokens)
+        await self.credit.from_tokens(
+            user_id, model, input_tokens, output_tokens, provider="openai",
+            chat_id=chat_completion.chat_id, latency_ms=int((time.time() - start) * 1000))
 
 
     async def gen_image(self, user_id, prompt, model = 'dall-e-3'):
@@ -102,7 +106,7 @@ class GPT:
             response_format='b64_json',
             n=1)
 
-        self.credit.from_costs(user_id, 0.04)
+        await self.credit.from_costs(user_id, 0.04, model=model, provider="openai")
         return response
 
     def num_tokens_from_messages(self, messages, model="gpt-3.5-turbo-0613"):
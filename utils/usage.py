@@ -0,0 +1,168 @@
+import asyncio
+import time
+
+from utils import log
+
+
+log = log.Logger(__name__, clevel=log.logging.DEBUG)
+
+class UsageAccumulator:
+    '''
+    collect token usage in memory and hand it to flush_cb in batches,
+    every flush_ms or every flush_events events, whichever comes first
+    flush_cb: async callable, receives
+        pending: dict (user_id, model): [input, output], usage to charge
+        events: list of event dicts for the usage ledger
+        and returns False if the batch has to be kept for the next flush
+    a batch failing MAX_FAILURES times in a row is split: the usage is
+    charged alone, then the ledger is written in halves down to the events
+    that fail on their own, which are parked. when the charges (or, for a
+    ledger only batch, the first events one by one) fail as well, the
+    database is down and the batch is kept whole
+    '''
+    MAX_FAILURES = 3
+    # events kept while flushes fail, the oldest are dropped beyond that
+    MAX_LEDGER = 100000
+    MAX_PARKED = 1000
+    # single events tried to tell a bad batch from a database outage
+    PROBE_EVENTS = 3
+
+    def __init__(self, flush_cb, flush_ms=500, flush_events=200):
+        self.flush_cb = flush_cb
+        self.flush_interval = flush_ms / 1000
+        self.flush_events = flush_events
+        self.pending = {}
+        self.ledger = []
+        self.events = 0
+        # ledger events that could not be written, for inspection
+        self.parked = []
+        self.failures = 0
+        self._task = None
+        self._wake = None
+        self._full = None
+        self._lock = None
+
+    def add(self, user_id, model, input_tokens, output_tokens, **event):
+        '''
+        usage to charge, event: extra ledger fields (provider, chat_id, ...)
+        '''
+        tokens = self.pending.setdefault((user_id, model), [0, 0])
+        tokens[0] += input_tokens or 0
+        tokens[1] += output_tokens or 0
+        self.record(user_id=user_id, model=model, input_tokens=input_tokens or 0,
+                    output_tokens=output_tokens or 0, **event)
+
+    def record(self, **event):
+        '''
+        ledger only, for usage that is already charged
+        '''
+        event.setdefault("created_at", int(time.time()))
+        self.ledger.append(event)
+        self.events += 1
+        self._ensure_task()
+        self._wake.set()
+        if self.events >= self.flush_events:
+            self._full.set()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._full = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self._full.clear()
+            await self.flush()
+            if self.ledger:
+                # failed batch or new events during the flush
+                self._wake.set()
+
+    def _merge_back(self, pending, ledger):
+        for key, (input_tokens, output_tokens) in pending.items():
+            tokens = self.pending.setdefault(key, [0, 0])
+            tokens[0] += input_tokens
+            tokens[1] += output_tokens
+        self.ledger[:0] = ledger
+        self.events += len(ledger)
+        if len(self.ledger) > self.MAX_LEDGER:
+            dropped = len(self.ledger) - self.MAX_LEDGER
+            del self.ledger[:dropped]
+            self.events -= dropped
+            log.error(f"usage ledger full, dropped {dropped} events")
+
+    async def _call(self, pending, ledger):
+        try:
+            return await self.flush_cb(pending, ledger) is not False
+        except Exception as err:
+            log.error(f"usage flush error:{err}")
+            return False
+
+    async def _write_ledger(self, ledger):
+        '''
+        write the ledger in halves, parking the events that fail alone
+        '''
+        if await self._call({}, ledger):
+            return
+        if len(ledger) == 1:
+            log.error(f"usage event parked: {ledger[0]}")
+            self.parked.append(ledger[0])
+            del self.parked[:-self.MAX_PARKED]
+            return
+        mid = len(ledger) // 2
+        await self._write_ledger(ledger[:mid])
+        await self._write_ledger(ledger[mid:])
+
+    async def flush(self):
+        if not self.ledger:
+            return
+        async with self._lock:
+            pending, self.pending = self.pending, {}
+            ledger, self.ledger, self.events = self.ledger, [], 0
+            if await self._call(pending, ledger):
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures < self.MAX_FAILURES:
+                self._merge_back(pending, ledger)
+                return
+            # keeps failing, do not let a bad event hold up the charges
+            if pending:
+                probed = await self._call(pending, [])
+            else:
+                # record() events, their credit is already deducted
+                probed = False
+                for i, event in enumerate(ledger[:self.PROBE_EVENTS]):
+                    if await self._call({}, [event]):
+                        probed = True
+                        ledger = ledger[:i] + ledger[i + 1:]
+                        break
+                if not probed:
+                    # the probed ones go last, in case they are the bad ones
+                    ledger = ledger[self.PROBE_EVENTS:] + ledger[:self.PROBE_EVENTS]
+            if not probed:
+                # the database itself fails, keep everything
+                self._merge_back(pending, ledger)
+                return
+            self.failures = 0
+            await self._write_ledger(ledger)
+
+    async def close(self):
+        if self._task is None:
+            return
+        # a flush in progress has taken its batch off self, let it finish
+        # or merge it back before the loop is cancelled
+        async with self._lock:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()